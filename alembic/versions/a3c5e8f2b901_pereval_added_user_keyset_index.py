@@ -0,0 +1,26 @@
+"""Composite index for keyset pagination of user perevals
+
+Revision ID: a3c5e8f2b901
+Revises: 1e0f71eaa5d4
+Create Date: 2025-03-02 12:10:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c5e8f2b901'
+down_revision: Union[str, None] = '1e0f71eaa5d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_pereval_added_user_id_add_time_id', 'pereval_added', ['user_id', 'add_time', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pereval_added_user_id_add_time_id', table_name='pereval_added')
@@ -0,0 +1,55 @@
+"""Change feed sequence of perevals and their status history
+
+Revision ID: a8d4c2e6f013
+Revises: f6b1d3e8a29c
+Create Date: 2025-04-13 11:02:47.316820
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d4c2e6f013'
+down_revision: Union[str, None] = 'f6b1d3e8a29c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('change_counter',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('pereval_status_changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pereval_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('changed_at', sa.TIMESTAMP(), server_default=sa.func.now(), nullable=False),
+    sa.Column('change_seq', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['pereval_id'], ['pereval_added.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_pereval_status_changes_change_seq'), 'pereval_status_changes', ['change_seq'], unique=False)
+
+    # Existing passes enter the feed in id order with their current status
+    op.add_column('pereval_added', sa.Column('change_seq', sa.BigInteger(), nullable=True))
+    op.execute('UPDATE pereval_added SET change_seq = id')
+    op.alter_column('pereval_added', 'change_seq', nullable=False)
+    op.create_index('ix_pereval_added_user_id_change_seq', 'pereval_added', ['user_id', 'change_seq'], unique=False)
+    op.execute(
+        "INSERT INTO pereval_status_changes (pereval_id, status, change_seq) "
+        "SELECT id, coalesce(status, 'new'), change_seq FROM pereval_added"
+    )
+    op.execute("INSERT INTO change_counter (id, value) SELECT 1, coalesce(max(change_seq), 0) FROM pereval_added")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pereval_added_user_id_change_seq', table_name='pereval_added')
+    op.drop_column('pereval_added', 'change_seq')
+    op.drop_index(op.f('ix_pereval_status_changes_change_seq'), table_name='pereval_status_changes')
+    op.drop_table('pereval_status_changes')
+    op.drop_table('change_counter')
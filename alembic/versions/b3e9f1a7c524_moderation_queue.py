@@ -0,0 +1,31 @@
+"""Moderation queue: claimed_by and partial index on new passes
+
+Revision ID: b3e9f1a7c524
+Revises: a8d4c2e6f013
+Create Date: 2025-04-20 10:14:33.508127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e9f1a7c524'
+down_revision: Union[str, None] = 'a8d4c2e6f013'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('pereval_added', sa.Column('claimed_by', sa.String(), nullable=True))
+    op.create_index(
+        'ix_pereval_added_new_id', 'pereval_added', ['id'], unique=False,
+        postgresql_where=sa.text("status = 'new'"), sqlite_where=sa.text("status = 'new'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pereval_added_new_id', table_name='pereval_added')
+    op.drop_column('pereval_added', 'claimed_by')
@@ -0,0 +1,56 @@
+"""Move inline pereval images into the blob store
+
+Revision ID: b7d2e4a91c3f
+Revises: a3c5e8f2b901
+Create Date: 2025-03-09 17:42:03.518267
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from fastapi_pereval.storage import get_storage, is_reference, store_inline_image
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d2e4a91c3f'
+down_revision: Union[str, None] = 'a3c5e8f2b901'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+pereval_images = sa.table(
+    'pereval_images',
+    sa.column('id', sa.Integer),
+    sa.column('img', sa.String),
+)
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    storage = get_storage()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(pereval_images.c.id, pereval_images.c.img)
+            .where(pereval_images.c.id > last_id)
+            .order_by(pereval_images.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        for image_id, img in rows:
+            if not is_reference(img):
+                connection.execute(
+                    pereval_images.update()
+                    .where(pereval_images.c.id == image_id)
+                    .values(img=store_inline_image(storage, img))
+                )
+        last_id = rows[-1].id
+
+
+def downgrade() -> None:
+    # Blob references are kept, the stored files remain readable through GET /images/{id}
+    pass
@@ -0,0 +1,61 @@
+"""Geohash column on coords for spatial lookups
+
+Revision ID: c41f9a7d2e58
+Revises: b7d2e4a91c3f
+Create Date: 2025-03-16 11:05:27.730914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from fastapi_pereval import geo
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41f9a7d2e58'
+down_revision: Union[str, None] = 'b7d2e4a91c3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+coords = sa.table(
+    'coords',
+    sa.column('id', sa.Integer),
+    sa.column('latitude', sa.Float),
+    sa.column('longitude', sa.Float),
+    sa.column('geohash', sa.String),
+)
+
+
+def upgrade() -> None:
+    op.add_column('coords', sa.Column('geohash', sa.String(length=geo.PRECISION), nullable=True))
+
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(coords.c.id, coords.c.latitude, coords.c.longitude)
+            .where(coords.c.id > last_id)
+            .order_by(coords.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            coords.update().where(coords.c.id == sa.bindparam('coords_id')),
+            [
+                {'coords_id': row.id, 'geohash': geo.encode(row.latitude, row.longitude)}
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+    op.create_index(op.f('ix_coords_geohash'), 'coords', ['geohash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_coords_geohash'), table_name='coords')
+    op.drop_column('coords', 'geohash')
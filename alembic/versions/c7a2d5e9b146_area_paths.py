@@ -0,0 +1,60 @@
+"""Materialized paths of pereval_areas and area of perevals
+
+Revision ID: c7a2d5e9b146
+Revises: b3e9f1a7c524
+Create Date: 2025-04-27 16:40:05.712394
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from fastapi_pereval import areas
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7a2d5e9b146'
+down_revision: Union[str, None] = 'b3e9f1a7c524'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('pereval_areas', sa.Column('path', sa.String(), nullable=True))
+    op.create_index(
+        'ix_pereval_areas_path', 'pereval_areas', ['path'], unique=False,
+        postgresql_ops={'path': 'text_pattern_ops'},
+    )
+    op.add_column('pereval_added', sa.Column('area_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'pereval_added_area_id_fkey', 'pereval_added', 'pereval_areas', ['area_id'], ['id'],
+    )
+    op.create_index(op.f('ix_pereval_added_area_id'), 'pereval_added', ['area_id'], unique=False)
+
+    # The reference tree is small, compute the paths in Python instead of a recursive query
+    connection = op.get_bind()
+    parents = dict(connection.execute(sa.text('SELECT id, id_parent FROM pereval_areas')).all())
+    paths = {}
+
+    def path(area_id, seen=()):
+        if area_id not in paths:
+            parent_id = parents[area_id]
+            if parent_id in parents and parent_id not in seen:
+                paths[area_id] = areas.child_path(path(parent_id, seen + (area_id,)), area_id)
+            else:
+                paths[area_id] = areas.child_path(None, area_id)
+        return paths[area_id]
+
+    for area_id in parents:
+        connection.execute(
+            sa.text('UPDATE pereval_areas SET path = :path WHERE id = :id'), {'path': path(area_id), 'id': area_id},
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_pereval_added_area_id'), table_name='pereval_added')
+    op.drop_constraint('pereval_added_area_id_fkey', 'pereval_added', type_='foreignkey')
+    op.drop_column('pereval_added', 'area_id')
+    op.drop_index('ix_pereval_areas_path', table_name='pereval_areas')
+    op.drop_column('pereval_areas', 'path')
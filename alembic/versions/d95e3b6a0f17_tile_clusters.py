@@ -0,0 +1,50 @@
+"""Per-zoom tile cluster aggregates
+
+Revision ID: d95e3b6a0f17
+Revises: c41f9a7d2e58
+Create Date: 2025-03-23 15:48:12.064390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from fastapi_pereval import tiles
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd95e3b6a0f17'
+down_revision: Union[str, None] = 'c41f9a7d2e58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    op.create_table('tile_clusters',
+    sa.Column('zoom', sa.Integer(), nullable=False),
+    sa.Column('cell_x', sa.Integer(), nullable=False),
+    sa.Column('cell_y', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('sum_latitude', sa.Float(), nullable=False),
+    sa.Column('sum_longitude', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('zoom', 'cell_x', 'cell_y')
+    )
+
+    connection = op.get_bind()
+    rows = connection.execute(sa.text(
+        'SELECT coords.latitude, coords.longitude FROM pereval_added '
+        'JOIN coords ON pereval_added.coord_id = coords.id'
+    ))
+    while batch := rows.fetchmany(BATCH_SIZE):
+        deltas = sorted(tiles.cluster_deltas(batch).items())
+        for start in range(0, len(deltas), tiles.UPSERT_BATCH_SIZE):
+            connection.execute(tiles.upsert_statement(
+                connection.dialect.name, dict(deltas[start:start + tiles.UPSERT_BATCH_SIZE]),
+            ))
+
+
+def downgrade() -> None:
+    op.drop_table('tile_clusters')
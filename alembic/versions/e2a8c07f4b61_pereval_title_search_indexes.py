@@ -0,0 +1,41 @@
+"""Full-text and trigram indexes for pass title search
+
+Revision ID: e2a8c07f4b61
+Revises: d95e3b6a0f17
+Create Date: 2025-03-30 10:21:56.381742
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from fastapi_pereval.search import SEARCH_DOCUMENT
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a8c07f4b61'
+down_revision: Union[str, None] = 'd95e3b6a0f17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute(
+        'CREATE INDEX ix_pereval_added_search_tsv ON pereval_added '
+        f"USING gin (to_tsvector('simple', {SEARCH_DOCUMENT}))"
+    )
+    op.execute(
+        'CREATE INDEX ix_pereval_added_search_trgm ON pereval_added '
+        f'USING gin ({SEARCH_DOCUMENT} gin_trgm_ops)'
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('DROP INDEX IF EXISTS ix_pereval_added_search_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_pereval_added_search_tsv')
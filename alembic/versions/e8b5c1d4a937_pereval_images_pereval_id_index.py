@@ -0,0 +1,25 @@
+"""Index pereval_images.pereval_id for image counts and image loading
+
+Revision ID: e8b5c1d4a937
+Revises: d1f6a3b8e702
+Create Date: 2025-05-11 09:47:26.183550
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b5c1d4a937'
+down_revision: Union[str, None] = 'd1f6a3b8e702'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_pereval_images_pereval_id'), 'pereval_images', ['pereval_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_pereval_images_pereval_id'), table_name='pereval_images')
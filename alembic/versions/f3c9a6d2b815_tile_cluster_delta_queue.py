@@ -0,0 +1,37 @@
+"""Queue tile cluster deltas instead of updating the aggregates in every write
+
+Revision ID: f3c9a6d2b815
+Revises: e8b5c1d4a937
+Create Date: 2025-05-18 10:12:40.517309
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c9a6d2b815'
+down_revision: Union[str, None] = 'e8b5c1d4a937'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('tile_cluster_deltas',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('zoom', sa.Integer(), nullable=False),
+    sa.Column('cell_x', sa.Integer(), nullable=False),
+    sa.Column('cell_y', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('sum_latitude', sa.Float(), nullable=False),
+    sa.Column('sum_longitude', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tile_cluster_deltas_cell', 'tile_cluster_deltas', ['zoom', 'cell_x', 'cell_y'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tile_cluster_deltas_cell', table_name='tile_cluster_deltas')
+    op.drop_table('tile_cluster_deltas')
@@ -0,0 +1,28 @@
+"""Version and update time of perevals for conditional requests
+
+Revision ID: f6b1d3e8a29c
+Revises: e2a8c07f4b61
+Create Date: 2025-04-06 13:37:09.902155
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6b1d3e8a29c'
+down_revision: Union[str, None] = 'e2a8c07f4b61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('pereval_added', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('pereval_added', sa.Column('updated_at', sa.TIMESTAMP(), server_default=sa.func.now(), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('pereval_added', 'updated_at')
+    op.drop_column('pereval_added', 'version')
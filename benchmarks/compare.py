@@ -0,0 +1,76 @@
+"""Compare two benchmark reports written by benchmarks.run.
+
+    python -m benchmarks.compare baseline.json results.json --threshold 10
+
+Prints the change of every metric per scenario and exits with status 1 when a
+latency percentile or queries per request grew, or requests per second dropped,
+by more than the threshold percentage, or a scenario has more errors than before.
+"""
+import argparse
+import json
+import sys
+
+# Metric path in a scenario report and whether a higher value is better
+METRICS = [
+    (("rps",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("queries_per_request",), False),
+]
+
+
+def metric(scenario: dict, path):
+    for key in path:
+        scenario = scenario[key]
+    return scenario
+
+
+def compare(baseline: dict, results: dict, threshold: float):
+    """Get printable rows and the regressed metrics of every scenario present in both reports"""
+    rows = []
+    regressions = []
+    for name, scenario in results["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        for path, higher_is_better in METRICS:
+            old = metric(baseline["scenarios"][name], path)
+            new = metric(scenario, path)
+            change = (new - old) / old * 100 if old else 0.0
+            regressed = -change > threshold if higher_is_better else change > threshold
+            label = f"{name}.{'.'.join(path)}"
+            rows.append(f"{label:<32} {old:>12.3f} {new:>12.3f} {change:>+9.1f}%{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(label)
+        # Failed requests are left out of the timings, so new errors could otherwise look like a speedup
+        old_errors = baseline["scenarios"][name].get("errors", 0)
+        if scenario["errors"] > old_errors:
+            label = f"{name}.errors"
+            rows.append(f"{label:<32} {old_errors:>12} {scenario['errors']:>12} {'':>10}  REGRESSION")
+            regressions.append(label)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("results")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed change in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    with open(args.results, encoding="utf-8") as file:
+        results = json.load(file)
+
+    print(f"baseline {baseline.get('commit')}  results {results.get('commit')}")
+    rows, regressions = compare(baseline, results, args.threshold)
+    print(f"{'metric':<32} {'baseline':>12} {'results':>12} {'change':>10}")
+    print("\n".join(rows))
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by more than {args.threshold}%", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
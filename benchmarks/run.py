@@ -0,0 +1,290 @@
+"""Load test of the pass API against a local server.
+
+Seeds a dataset with Faker, starts the app with uvicorn in a background thread and
+drives create/get/patch/list requests at a fixed concurrency. The report is JSON with
+latency percentiles, requests per second and database queries per request:
+
+    python -m benchmarks.run --requests 2000 --concurrency 32 --output results.json
+    python -m benchmarks.compare baseline.json results.json
+
+The database defaults to a temporary SQLite file; pass --database-url to benchmark
+PostgreSQL (the schema must already be migrated).
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+import uvicorn
+from faker import Faker
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from fastapi_pereval import imaging, models, schemas, services, storage
+from fastapi_pereval.main import app, get_db, get_session_factory, get_storage
+
+SCENARIOS = ("create", "get", "patch", "list")
+SEED_BATCH_SIZE = 500
+
+
+class QueryCounter:
+    """Counts statements executed by an engine from any thread"""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.count += 1
+
+
+def fake_pereval(fake: Faker, user: dict, images: int) -> dict:
+    return {
+        "beauty_title": fake.word(),
+        "title": fake.city(),
+        "other_titles": fake.street_name(),
+        "connect": fake.sentence(),
+        "add_time": fake.date_time_between("-3y").isoformat(),
+        "user": user,
+        "coords": {
+            "latitude": float(fake.latitude()),
+            "longitude": float(fake.longitude()),
+            "height": fake.random_int(500, 7000),
+        },
+        "winter_level": fake.random_element(["", "1A", "1B", "2A", "2B", "3A"]),
+        "summer_level": fake.random_element(["", "1A", "1B", "2A", "2B", "3A"]),
+        "autumn_level": fake.random_element(["", "1A", "1B", "2A"]),
+        "spring_level": fake.random_element(["", "1A", "1B", "2A"]),
+        "images": [
+            {"img_title": fake.word(), "img": base64.b64encode(fake.binary(length=2048)).decode()}
+            for _ in range(images)
+        ],
+    }
+
+
+def fake_user(fake: Faker) -> dict:
+    return {
+        "email": fake.unique.email(),
+        "phone": fake.phone_number(),
+        "fam": fake.last_name(),
+        "name": fake.first_name(),
+        "otc": fake.first_name(),
+    }
+
+
+async def seed(database_url: str, blob_storage: storage.BlobStorage, fake: Faker, users: int, perevals: int):
+    """Create the schema if needed and insert users and passes with stored images through the bulk write path"""
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+
+    seeded_users = [fake_user(fake) for _ in range(users)]
+    session_factory = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+    async with session_factory() as db:
+        db_service = services.DatabaseService(db)
+        for start in range(0, perevals, SEED_BATCH_SIZE):
+            batch = []
+            for _ in range(min(SEED_BATCH_SIZE, perevals - start)):
+                data = fake_pereval(fake, fake.random_element(seeded_users), fake.random_int(0, 3))
+                for image in data["images"]:
+                    image["img"] = blob_storage.put(base64.b64decode(image["img"]))
+                batch.append(schemas.PerevalAddedCreate.model_validate(data))
+            await db_service.submit_perevals(batch)
+
+        pereval_ids = (await db.execute(select(models.PerevalAdded.id))).scalars().all()
+        emails = (await db.execute(select(models.User.email))).scalars().all()
+    await engine.dispose()
+    return list(pereval_ids), list(emails)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int):
+    # The lifespan is off: it loads startup state from the configured FSTR_DB_* database
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def is_error(response: httpx.Response) -> bool:
+    """Check the HTTP status and, since the API reports many failures as 200, the body's status or state"""
+    if response.status_code >= 400:
+        return True
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        return False
+    body = response.json()
+    if not isinstance(body, dict):
+        return False
+    # A pass has a string status, submit results have an HTTP-like number
+    status = body.get("status")
+    return (isinstance(status, int) and status >= 400) or body.get("state") == 0
+
+
+def summarize(latencies, errors: int, elapsed: float, queries: int) -> dict:
+    """Latencies and requests per second are of successful requests only, errors are counted apart"""
+    latencies_ms = sorted(latency * 1000 for latency in latencies) or [0.0]
+    percentiles = statistics.quantiles(latencies_ms, n=100, method="inclusive") if len(latencies_ms) > 1 else latencies_ms * 99
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentiles[49], 3),
+            "p95": round(percentiles[94], 3),
+            "p99": round(percentiles[98], 3),
+            "mean": round(statistics.fmean(latencies_ms), 3),
+            "max": round(latencies_ms[-1], 3),
+        },
+        "queries_per_request": round(queries / max(1, len(latencies) + errors), 3),
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, make_request, requests: int, concurrency: int, counter: QueryCounter):
+    """Send requests from concurrency workers and summarize them, see is_error for what counts as an error"""
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in remaining:
+            method, url, body = make_request(index)
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            elapsed = time.perf_counter() - started
+            if is_error(response):
+                errors += 1
+            else:
+                latencies.append(elapsed)
+
+    queries = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started, counter.count - queries)
+
+
+async def drive(base_url: str, args, fake: Faker, pereval_ids, emails, counter: QueryCounter) -> dict:
+    users = [fake_user(fake) for _ in range(max(1, args.users // 10))]
+    rng = random.Random(args.random_seed)
+    requests = {
+        "create": lambda index: ("POST", "/submitData", fake_pereval(fake, rng.choice(users), rng.randint(0, 2))),
+        "get": lambda index: ("GET", f"/submitData/{rng.choice(pereval_ids)}", None),
+        "patch": lambda index: (
+            "PATCH", f"/submitData/{rng.choice(pereval_ids)}", fake_pereval(fake, rng.choice(users), 0),
+        ),
+        "list": lambda index: ("GET", f"/submitData/?user_email={rng.choice(emails)}&limit=50", None),
+    }
+
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        for scenario in args.scenarios:
+            if args.warmup:
+                await run_scenario(client, requests[scenario], args.warmup, args.concurrency, counter)
+            results[scenario] = await run_scenario(
+                client, requests[scenario], args.requests, args.concurrency, counter,
+            )
+            print(f"{scenario}: {json.dumps(results[scenario])}", file=sys.stderr)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pass API against a local server")
+    parser.add_argument("--database-url", help="async SQLAlchemy URL, a temporary SQLite file by default")
+    parser.add_argument("--users", type=int, default=100, help="users to seed")
+    parser.add_argument("--perevals", type=int, default=2000, help="passes to seed")
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", help="report file, stdout by default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(workdir, 'benchmark.db')}"
+        blob_storage = storage.LocalBlobStorage(os.path.join(workdir, "media"))
+        fake = Faker()
+        Faker.seed(args.random_seed)
+
+        pereval_ids, emails = asyncio.run(seed(database_url, blob_storage, fake, args.users, args.perevals))
+
+        # The engine of the server is created here but connects lazily, on the server's event loop
+        engine = create_async_engine(database_url)
+        session_factory = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+        counter = QueryCounter(engine)
+
+        async def override_get_db():
+            async with session_factory() as session:
+                yield session
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_session_factory] = lambda: session_factory
+        app.dependency_overrides[get_storage] = lambda: blob_storage
+
+        port = free_port()
+        server, thread = start_server(port)
+        try:
+            results = asyncio.run(drive(f"http://127.0.0.1:{port}", args, fake, pereval_ids, emails, counter))
+        finally:
+            server.should_exit = True
+            thread.join()
+            app.dependency_overrides.clear()
+            imaging.get_image_processor().shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "config": {
+            "users": args.users,
+            "perevals": args.perevals,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "random_seed": args.random_seed,
+        },
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+from typing import Optional
+
+from sqlalchemy import String, func, literal, update
+
+from . import models
+
+# Materialized path of an area: ids from the root down to the area, each followed by a separator,
+# e.g. "1/5/12/". Every subtree is the set of paths starting with the path of its root.
+SEPARATOR = "/"
+
+
+def child_path(parent_path: Optional[str], area_id: int) -> str:
+    return f"{parent_path or ''}{area_id}{SEPARATOR}"
+
+
+def path_ids(path: str):
+    """Get the ids of an area and its ancestors, root first"""
+    return [int(area_id) for area_id in path.split(SEPARATOR) if area_id]
+
+
+def in_subtree(path: str):
+    """Condition selecting the area with this path and all its descendants"""
+    return models.PerevalAreas.path.startswith(path, autoescape=True)
+
+
+async def move_subtree(db, old_path: str, new_path: str):
+    """Rewrite the paths of an area and its descendants after it got a new parent"""
+    table = models.PerevalAreas.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.path.startswith(old_path, autoescape=True))
+        .values(path=literal(new_path, String).concat(func.substr(table.c.path, len(old_path) + 1)))
+    )
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from .metrics import Counter, registry
+
+CACHE_SIZE = int(os.getenv("FSTR_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("FSTR_CACHE_TTL", "60"))
+
+cache_hits = registry.register(Counter("response_cache_hits_total", "Response cache hits"))
+cache_misses = registry.register(Counter("response_cache_misses_total", "Response cache misses"))
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: str
+    version: int
+
+
+class CacheBackend(ABC):
+    """Interface of a response cache, a shared backend (e.g. Redis) can implement it"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CachedResponse]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: CachedResponse):
+        """Store a response unless the key holds a newer version or was invalidated for a newer one"""
+        ...
+
+    @abstractmethod
+    def delete(self, key: str, version: int):
+        """Invalidate a key after a write that produced version.
+
+        A reader that loaded the row before the write may call set afterwards, so the cache
+        must keep rejecting responses older than version for as long as an entry could live.
+        """
+        ...
+
+
+class TTLCache(CacheBackend):
+    """In-process LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (expires, response or None for an invalidation tombstone, version)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._entries.pop(key)
+                entry = None
+            if entry is None or entry[1] is None:
+                cache_misses.inc()
+                return None
+            self._entries.move_to_end(key)
+        cache_hits.inc()
+        return entry[1]
+
+    def _store(self, key: str, value: Optional[CachedResponse], version: int):
+        self._entries[key] = (time.monotonic() + self.ttl, value, version)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def set(self, key: str, value: CachedResponse):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic() and entry[2] > value.version:
+                return
+            self._store(key, value, value.version)
+
+    def delete(self, key: str, version: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic() and entry[2] >= version:
+                return
+            self._store(key, None, version)
+
+
+def pereval_key(pereval_id: int) -> str:
+    return f"pereval:{pereval_id}"
+
+
+@lru_cache
+def get_response_cache() -> CacheBackend:
+    """Get the response cache configured for the application"""
+    return TTLCache(CACHE_SIZE, CACHE_TTL)
@@ -0,0 +1,60 @@
+from typing import Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, insert, update
+
+from . import models
+
+COUNTER_ID = 1
+
+
+async def allocate(db, count: int = 1) -> int:
+    """Reserve count consecutive change sequence numbers and return the first one.
+
+    The counter row stays locked until the transaction ends, so sequence numbers
+    become visible in the order they were handed out and a reader never skips a
+    change that commits later with a lower number. Every writer waits for that
+    lock, so call this through stamp as the last statement before commit.
+    """
+    table = models.ChangeCounter.__table__
+    last = (await db.execute(
+        update(table).where(table.c.id == COUNTER_ID).values(value=table.c.value + count).returning(table.c.value)
+    )).scalar()
+    if last is None:
+        # Fresh database without the row seeded by the migration
+        await db.execute(insert(table).values(id=COUNTER_ID, value=count))
+        last = count
+    return last - count + 1
+
+
+async def record_status_changes(db, changes: Iterable[Tuple[int, str, int]]):
+    """Append (pereval_id, status, change_seq) rows to the status history"""
+    rows = [
+        {"pereval_id": pereval_id, "status": status, "change_seq": change_seq}
+        for pereval_id, status, change_seq in changes
+    ]
+    if rows:
+        await db.execute(insert(models.PerevalStatusChange), rows)
+
+
+
+async def stamp(db, pereval_ids: Sequence[int], status: Optional[str] = None):
+    """Give each pereval the next change sequence number, recording a status change if status is set.
+
+    Meant to run right before commit, after every other write of the transaction, so the
+    counter lock is held only for this statement and the commit.
+    """
+    if not pereval_ids:
+        return
+    first_seq = await allocate(db, len(pereval_ids))
+    table = models.PerevalAdded.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.id == bindparam("pereval_id"))
+        # Keep updated_at, this is bookkeeping rather than a change of the pass
+        .values(change_seq=bindparam("seq"), updated_at=table.c.updated_at),
+        [{"pereval_id": pereval_id, "seq": first_seq + index} for index, pereval_id in enumerate(pereval_ids)],
+    )
+    if status is not None:
+        await record_status_changes(db, (
+            (pereval_id, status, first_seq + index) for index, pereval_id in enumerate(pereval_ids)
+        ))
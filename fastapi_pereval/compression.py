@@ -0,0 +1,164 @@
+import os
+import zlib
+from typing import Optional, Tuple
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+MINIMUM_SIZE = int(os.getenv("FSTR_COMPRESSION_MINIMUM_SIZE", "1024"))
+GZIP_LEVEL = 6
+# Quality 4 compresses JSON better than gzip -6 at a similar speed, the maximum of 11 is far too slow per request
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+ENCODINGS = ("br", "gzip")
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Pick the best supported encoding of an Accept-Encoding header, brotli wins ties"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best = None
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (encoding, weight)
+    return best[0] if best else None
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Tag a compressed representation, e.g. "7-2" becomes "7-2-br", so it has its own strong ETag"""
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+
+def strip_etag_encodings(tags: str) -> Tuple[str, Optional[str]]:
+    """Remove the encoding suffixes from a list of entity tags, return it and the last encoding removed"""
+    stripped = []
+    found = None
+    for tag in tags.split(","):
+        tag = tag.strip()
+        for encoding in ENCODINGS:
+            if tag.endswith(f'-{encoding}"'):
+                tag = tag[:-len(encoding) - 2] + '"'
+                found = encoding
+                break
+        stripped.append(tag)
+    return ", ".join(stripped), found
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk and flush it, so streamed responses are not held back"""
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """Compress JSON and text responses with brotli or gzip, as negotiated by Accept-Encoding"""
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # The app knows only the ETags of uncompressed bodies, validators of compressed ones are mapped back
+        tag_encoding = None
+        headers = []
+        for name, value in scope["headers"]:
+            if name in (b"if-none-match", b"if-match"):
+                tags, found = strip_etag_encodings(value.decode("latin-1"))
+                if found:
+                    value = tags.encode("latin-1")
+                    tag_encoding = found
+            headers.append((name, value))
+        if tag_encoding is not None:
+            # In place, outer middleware reads what routing stores in this scope
+            scope["headers"] = headers
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                content_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    # A 304 carries the ETag of the representation the client validated
+                    if start_message["status"] == 304 and "etag" in headers and tag_encoding == encoding:
+                        headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                if "etag" in headers:
+                    headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["content-length"]
+                    body = compressor.compress(body)
+                else:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                await send(start_message)
+                start_message = None
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            if compressor is None:
+                await send(message)
+                return
+            body = compressor.compress(body)
+            if not more_body:
+                body += compressor.finish()
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
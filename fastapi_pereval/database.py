@@ -1,6 +1,11 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-import os 
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import os
+import time
+
+from .instrumentation import instrument_engine
+from .metrics import Gauge, Histogram, registry
 
 DB_HOST = os.getenv("FSTR_DB_HOST")
 DB_PORT = os.getenv("FSTR_DB_PORT")
@@ -8,10 +13,46 @@ DB_LOGIN = os.getenv("FSTR_DB_LOGIN")
 DB_PASS = os.getenv("FSTR_DB_PASS")
 DB_NAME = os.getenv("FSTR_DB_NAME")
 
-DATABASE_URL = f"postgresql://{DB_LOGIN}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+DB_POOL_SIZE = int(os.getenv("FSTR_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("FSTR_DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("FSTR_DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("FSTR_DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("FSTR_DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+DATABASE_URL = f"postgresql+asyncpg://{DB_LOGIN}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+pool_wait_seconds = registry.register(Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a connection from the pool",
+))
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_seconds.observe(time.perf_counter() - start)
+
+
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+instrument_engine(engine)
 
-engine = create_engine(DATABASE_URL)
+registry.register(Gauge("db_pool_size", "Configured number of pooled connections", lambda: engine.pool.size()))
+registry.register(Gauge("db_pool_checked_out", "Connections currently checked out", lambda: engine.pool.checkedout()))
+registry.register(Gauge("db_pool_checked_in", "Idle connections in the pool", lambda: engine.pool.checkedin()))
+registry.register(Gauge("db_pool_overflow", "Connections opened above pool_size", lambda: engine.pool.overflow()))
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
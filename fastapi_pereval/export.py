@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+import sys
+from typing import AsyncIterator
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models
+
+BATCH_SIZE = 1000
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+CSV_COLUMNS = [
+    "id", "status", "title", "beauty_title", "other_titles", "connect", "add_time",
+    "winter_level", "summer_level", "autumn_level", "spring_level",
+    "latitude", "longitude", "height",
+    "user_email", "user_fam", "user_name", "user_otc", "user_phone",
+    "images",
+]
+
+EXPORT_QUERY = (
+    select(
+        models.PerevalAdded.id,
+        models.PerevalAdded.status,
+        models.PerevalAdded.title,
+        models.PerevalAdded.beauty_title,
+        models.PerevalAdded.other_titles,
+        models.PerevalAdded.connect,
+        models.PerevalAdded.add_time,
+        models.PerevalAdded.winter_level,
+        models.PerevalAdded.summer_level,
+        models.PerevalAdded.autumn_level,
+        models.PerevalAdded.spring_level,
+        models.Coords.latitude,
+        models.Coords.longitude,
+        models.Coords.height,
+        models.User.email.label("user_email"),
+        models.User.fam.label("user_fam"),
+        models.User.name.label("user_name"),
+        models.User.otc.label("user_otc"),
+        models.User.phone.label("user_phone"),
+    )
+    .outerjoin(models.Coords, models.PerevalAdded.coord_id == models.Coords.id)
+    .outerjoin(models.User, models.PerevalAdded.user_id == models.User.id)
+    .order_by(models.PerevalAdded.id)
+)
+
+
+async def iter_export_rows(db: AsyncSession, batch_size: int = BATCH_SIZE) -> AsyncIterator[dict]:
+    """Stream perevals joined with coords, user and image references using a server-side cursor"""
+    result = await db.stream(EXPORT_QUERY.execution_options(yield_per=batch_size))
+    async for partition in result.mappings().partitions():
+        rows = [dict(row) for row in partition]
+        images = {row["id"]: [] for row in rows}
+        image_rows = await db.execute(
+            select(
+                models.PerevalImages.pereval_id,
+                models.PerevalImages.id,
+                models.PerevalImages.img_title,
+                models.PerevalImages.img,
+            )
+            .where(models.PerevalImages.pereval_id.in_(list(images)))
+            .order_by(models.PerevalImages.id)
+        )
+        for pereval_id, image_id, img_title, img in image_rows:
+            images[pereval_id].append({"id": image_id, "img_title": img_title, "img": img})
+        for row in rows:
+            row["images"] = images[row["id"]]
+            yield row
+
+
+def _json_default(value):
+    return value.isoformat()
+
+
+async def iter_ndjson(rows: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for row in rows:
+        yield json.dumps(row, ensure_ascii=False, default=_json_default) + "\n"
+
+
+async def iter_csv(rows: AsyncIterator[dict]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    async for row in rows:
+        row["add_time"] = row["add_time"].isoformat() if row["add_time"] else None
+        row["images"] = ";".join(image["img"] for image in row["images"])
+        writer.writerow(row)
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_export(db: AsyncSession, format: str) -> AsyncIterator[str]:
+    """Stream the export in the given format as text chunks"""
+    rows = iter_export_rows(db)
+    return iter_csv(rows) if format == "csv" else iter_ndjson(rows)
+
+
+async def export(format: str, output):
+    async with database.SessionLocal() as db:
+        async for chunk in iter_export(db, format):
+            output.write(chunk)
+    await database.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export perevals with coords, users and image references")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--output", help="output file, stdout by default")
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output:
+            asyncio.run(export(args.format, output))
+    else:
+        asyncio.run(export(args.format, sys.stdout))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import math
+from typing import List, Tuple
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 12
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+# Upper bound of a prefix range, sorts after every geohash character
+PREFIX_END = "{"
+
+
+def encode(latitude: float, longitude: float, precision: int = PRECISION) -> str:
+    """Encode a point as a geohash of the given precision"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        value_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(geohash)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Get the (height, width) in degrees of a geohash cell"""
+    bits = precision * 5
+    lat_bits = bits // 2
+    lon_bits = bits - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _wrap_longitude(longitude: float) -> float:
+    return (longitude + 180.0) % 360.0 - 180.0
+
+
+def _clamp_latitude(latitude: float) -> float:
+    return max(-90.0, min(90.0, latitude))
+
+
+def radius_prefixes(latitude: float, longitude: float, radius_km: float) -> List[str]:
+    """Geohash prefixes whose cells together cover a circle, empty if it needs a full scan"""
+    km_per_lon_degree = KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6)
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if height * KM_PER_DEGREE >= radius_km and width * km_per_lon_degree >= radius_km:
+            break
+    else:
+        return []
+
+    return sorted({
+        encode(_clamp_latitude(latitude + dy * height), _wrap_longitude(longitude + dx * width), precision)
+        for dy in (-1, 0, 1)
+        for dx in (-1, 0, 1)
+    })
+
+
+def bbox_prefixes(
+    min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float, max_cells: int = 32,
+) -> List[str]:
+    """Geohash prefixes whose cells together cover a bounding box, empty if it needs a full scan"""
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor(max_latitude / height) - math.floor(min_latitude / height) + 1
+        columns = math.floor(max_longitude / width) - math.floor(min_longitude / width) + 1
+        if rows * columns <= max_cells:
+            break
+    else:
+        return []
+
+    prefixes = set()
+    for row in range(rows):
+        for column in range(columns):
+            prefixes.add(encode(
+                _clamp_latitude(min_latitude + row * height),
+                _wrap_longitude(min(min_longitude + column * width, max_longitude)),
+                precision,
+            ))
+    prefixes.add(encode(max_latitude, max_longitude, precision))
+    return sorted(prefixes)
@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+
+IDEMPOTENCY_TTL = float(os.getenv("FSTR_IDEMPOTENCY_TTL", str(24 * 3600)))
+SWEEP_INTERVAL = float(os.getenv("FSTR_IDEMPOTENCY_SWEEP_INTERVAL", "600"))
+SWEEP_BATCH_SIZE = 1000
+CLAIM_ATTEMPTS = 3
+MAX_KEY_LENGTH = 255
+
+logger = logging.getLogger(__name__)
+
+
+def request_hash(body: str) -> str:
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+async def begin(db, key: str, body_hash: str) -> Optional[models.IdempotencyKey]:
+    """Claim a key for a new request, or get the record of an earlier request with the same key.
+
+    The claim is committed right away so a concurrent retry sees it while the first request runs.
+    """
+    for _ in range(CLAIM_ATTEMPTS):
+        now = models.utcnow()
+        await db.execute(
+            delete(models.IdempotencyKey)
+            .where(models.IdempotencyKey.key == key, models.IdempotencyKey.expires_at < now)
+        )
+        db.add(models.IdempotencyKey(
+            key=key, request_hash=body_hash, expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL),
+        ))
+        try:
+            await db.commit()
+            return None
+        except IntegrityError:
+            await db.rollback()
+        record = await db.get(models.IdempotencyKey, key, populate_existing=True)
+        # None when the request holding the key abandoned it in between, so claim it again
+        if record is not None:
+            return record
+    raise RuntimeError(f"Could not claim Idempotency-Key {key}")
+
+
+async def complete(db, key: str, status_code: int, response: str):
+    """Store the response that retries with the key get, in the transaction that made the changes"""
+    await db.execute(
+        update(models.IdempotencyKey)
+        .where(models.IdempotencyKey.key == key)
+        .values(status_code=status_code, response=response)
+    )
+
+
+async def abandon(db, key: str):
+    """Release the key of a failed request so a retry runs it again"""
+    await db.rollback()
+    await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.key == key))
+    await db.commit()
+
+
+async def sweep(db) -> int:
+    """Delete expired keys in batches, return how many were deleted"""
+    deleted = 0
+    while True:
+        keys = (await db.execute(
+            select(models.IdempotencyKey.key)
+            .where(models.IdempotencyKey.expires_at < models.utcnow())
+            .limit(SWEEP_BATCH_SIZE)
+        )).scalars().all()
+        if not keys:
+            return deleted
+        await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.key.in_(keys)))
+        await db.commit()
+        deleted += len(keys)
+
+
+async def sweep_periodically(session_factory, interval: float = SWEEP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as db:
+                await sweep(db)
+        except Exception:
+            logger.exception("Idempotency key sweep failed")
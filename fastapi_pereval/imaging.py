@@ -0,0 +1,77 @@
+import io
+import logging
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from PIL import Image, UnidentifiedImageError
+
+from .storage import BlobStorage
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.getenv("FSTR_IMAGE_WORKERS", "2"))
+
+# Variant name -> longest side in pixels
+IMAGE_SIZES = {
+    "thumb": 128,
+    "small": 320,
+    "medium": 1024,
+}
+
+
+def generate_variants(blob_storage: BlobStorage, key: str):
+    """Create resized JPEG variants of a stored image next to the original"""
+    try:
+        original = Image.open(io.BytesIO(b"".join(blob_storage.iter_chunks(key))))
+        original.load()
+    except UnidentifiedImageError:
+        logger.warning("Blob %s is not an image, no variants generated", key)
+        return []
+
+    variants = []
+    for variant, size in IMAGE_SIZES.items():
+        image = original.copy()
+        image.thumbnail((size, size))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85, optimize=True)
+        variants.append(blob_storage.put_variant(key, variant, buffer.getvalue()))
+    return variants
+
+
+def _log_failure(future: Future):
+    if future.exception() is not None:
+        logger.error("Image variant generation failed", exc_info=future.exception())
+
+
+class ImageProcessor:
+    """Runs variant generation on a process pool, off the request path"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def schedule(self, blob_storage: BlobStorage, keys: Iterable[str]):
+        """Queue variant generation for the given image keys without waiting for it"""
+        for key in keys:
+            # workers=0 generates variants synchronously, which is only meant for tests
+            if self.workers == 0:
+                generate_variants(blob_storage, key)
+                continue
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._executor.submit(generate_variants, blob_storage, key).add_done_callback(_log_failure)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+@lru_cache
+def get_image_processor() -> ImageProcessor:
+    """Get the image processor configured for the application"""
+    return ImageProcessor(IMAGE_WORKERS)
@@ -0,0 +1,143 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from .metrics import Histogram, registry
+
+SLOW_QUERY_SECONDS = float(os.getenv("FSTR_SLOW_QUERY_MS", "200")) / 1000
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+logger = logging.getLogger(__name__)
+
+request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Total time of a request until the response starts",
+))
+request_db_seconds = registry.register(Histogram(
+    "http_request_db_seconds", "Time a request spent executing SQL statements",
+))
+request_serialization_seconds = registry.register(Histogram(
+    "http_request_serialization_seconds", "Time a request spent validating and encoding its response",
+))
+request_queries = registry.register(Histogram(
+    "http_request_queries", "SQL statements executed by a request", QUERY_COUNT_BUCKETS,
+))
+query_seconds = registry.register(Histogram("db_query_seconds", "Execution time of a SQL statement"))
+
+
+class RequestStats:
+    """Timings of the request being handled, shared by the tasks and greenlets it runs"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.endpoint_finished: Optional[float] = None
+
+    def server_timing(self, total_seconds: float) -> str:
+        """Format the timings as a Server-Timing header value"""
+        return (
+            f"db;dur={self.db_seconds * 1000:.1f};desc=\"{self.queries} queries\", "
+            f"ser;dur={self.serialization_seconds * 1000:.1f}, "
+            f"total;dur={total_seconds * 1000:.1f}"
+        )
+
+
+_current_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def start_request() -> RequestStats:
+    stats = RequestStats()
+    _current_stats.set(stats)
+    return stats
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current_stats.get()
+
+
+def record_request(stats: RequestStats, method: str, route: str, total_seconds: float):
+    request_seconds.observe(total_seconds, method=method, route=route)
+    request_db_seconds.observe(stats.db_seconds, method=method, route=route)
+    request_serialization_seconds.observe(stats.serialization_seconds, method=method, route=route)
+    request_queries.observe(stats.queries, method=method, route=route)
+
+
+@contextmanager
+def serialization_timer():
+    """Count the time of an explicit serialization in the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.serialization_seconds += time.perf_counter() - start
+
+
+class InstrumentedRoute(APIRoute):
+    """Route that counts the time between the endpoint returning and the response being built"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        call = self.dependant.call
+
+        async def timed_call(*call_args, **call_kwargs):
+            try:
+                return await call(*call_args, **call_kwargs)
+            finally:
+                stats = current_stats()
+                if stats is not None:
+                    stats.endpoint_finished = time.perf_counter()
+
+        # Endpoints run in a threadpool when they are not coroutines, keep those as they are
+        if asyncio.iscoroutinefunction(call):
+            self.dependant.call = timed_call
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            response = await handler(request)
+            stats = current_stats()
+            if stats is not None and stats.endpoint_finished is not None:
+                stats.serialization_seconds += time.perf_counter() - stats.endpoint_finished
+            return response
+
+        return timed_handler
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    query_seconds.observe(elapsed)
+    stats = current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        logger.warning("Slow query took %.1f ms: %s", elapsed * 1000, statement)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    """Time every statement of an engine, sync or async"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
@@ -1,175 +1,866 @@
-from fastapi import FastAPI, Depends
-from sqlalchemy.orm import Session
-from typing import List
-from . import database, services, schemas, models
+from fastapi import FastAPI, Depends, Header, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.formparsers import MultiPartException, MultiPartParser
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from types import SimpleNamespace
+from typing import List, Optional, Union
+from . import database, services, schemas, models, metrics, storage, imaging, export, tiles, search, cache, reference, idempotency, instrumentation, serialization, compression
 
-app = FastAPI()
 
-def get_db():
-    db = database.SessionLocal()
-    try:
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with database.SessionLocal() as db:
+        await reference.get_reference_data().refresh(db)
+    sweeper = asyncio.create_task(idempotency.sweep_periodically(database.SessionLocal))
+    tile_folder = asyncio.create_task(tiles.fold_periodically(database.SessionLocal))
+    yield
+    sweeper.cancel()
+    tile_folder.cancel()
+    imaging.get_image_processor().shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = instrumentation.InstrumentedRoute
+app.add_middleware(compression.CompressionMiddleware)
+
+BULK_MAX_ITEMS = 1000
+MULTIPART_MAX_FILES = 20
+MULTIPART_MAX_FILE_BYTES = 20 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Record query count, DB, serialization and total time of every request"""
+    stats = instrumentation.start_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    total_seconds = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    instrumentation.record_request(stats, request.method, route.path if route else "unmatched", total_seconds)
+    response.headers["Server-Timing"] = stats.server_timing(total_seconds)
+    return response
+
+async def get_db():
+    async with database.SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+def get_session_factory():
+    return database.SessionLocal
+
+
+def get_storage():
+    return storage.get_storage()
+
+
+def get_image_processor():
+    return imaging.get_image_processor()
+
+
+def get_search_index():
+    return search.get_search_index()
+
+
+def get_response_cache():
+    return cache.get_response_cache()
+
+
+def get_reference_data():
+    return reference.get_reference_data()
+
+
+def pereval_etag(pereval: models.PerevalAdded) -> str:
+    return f'"{pereval.id}-{pereval.version}"'
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def is_not_modified(request: Request, cached: cache.CachedResponse) -> bool:
+    """Check If-None-Match, or If-Modified-Since when no ETag was sent"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or cached.etag in [tag.strip() for tag in if_none_match.split(",")]
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(cached.last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def serialized_response(schema, value, many: bool = False, headers: Optional[dict] = None) -> Response:
+    """Serialize ORM objects straight to JSON instead of validating them through the response model"""
+    with instrumentation.serialization_timer():
+        body = serialization.dumps_many(schema, value) if many else serialization.dumps(schema, value)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def store_images(images: List[schemas.PerevalImagesCreate], blob_storage: storage.BlobStorage):
+    """Replace inline image data with blob store references"""
+    for image in images:
+        image.img = await run_in_threadpool(storage.store_inline_image, blob_storage, image.img)
 
 
 @app.post("/submitData")
-async def submit_data(pereval_data: schemas.PerevalAddedCreate, db: Session = Depends(get_db)):
-    """Create a new pereval in the database"""
+async def submit_data(
+    pereval_data: schemas.PerevalAddedCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=idempotency.MAX_KEY_LENGTH),
+    db: AsyncSession = Depends(get_db),
+    blob_storage: storage.BlobStorage = Depends(get_storage),
+    image_processor: imaging.ImageProcessor = Depends(get_image_processor),
+    search_index: search.SearchIndex = Depends(get_search_index),
+    reference_data: reference.ReferenceData = Depends(get_reference_data),
+):
+    """Create a new pereval in the database, retries with the same Idempotency-Key get the original response"""
+    error = await reference_data.validate_pereval(db, pereval_data)
+    if error:
+        return JSONResponse(status_code=400, content={
+            "status": 400,
+            "message": error,
+            "id": None
+        })
+
+    if idempotency_key is not None:
+        body_hash = idempotency.request_hash(pereval_data.model_dump_json())
+        record = await idempotency.begin(db, idempotency_key, body_hash)
+        if record is not None:
+            if record.request_hash != body_hash:
+                return JSONResponse(status_code=422, content={
+                    "status": 422,
+                    "message": "Idempotency-Key was already used with a different request",
+                    "id": None
+                })
+            if record.status_code is None:
+                return JSONResponse(status_code=409, content={
+                    "status": 409,
+                    "message": "A request with this Idempotency-Key is still in progress",
+                    "id": None
+                })
+            return Response(
+                content=record.response,
+                status_code=record.status_code,
+                media_type="application/json",
+                headers={"Idempotent-Replayed": "true"},
+            )
+
     try:
         db_service = services.DatabaseService(db)
 
-        user = db_service.get_user_by_email(pereval_data.user.email)
+        await store_images(pereval_data.images, blob_storage)
 
-        if not user:
-            user = db_service.create_user(pereval_data.user)
-
-        coords = db_service.create_coords(pereval_data.coords)
-        
-        pereval = db_service.create_pereval(
-            pereval_data=pereval_data, 
-            user_id=user.id,  
-            coords_id=coords.id  
-        )
-        
-        if pereval_data.images:
-            for image_data in pereval_data.images:
-                image_dict = image_data.model_dump()  
-                image_dict["pereval_id"] = pereval.id
-                db_service.create_pereval_images(schemas.PerevalImagesCreate(**image_dict))
-        
-        return {
-            "status": 200,
-            "message": "Pereval successfully created",
-            "id": pereval.id
-        }
+        # The response for retries is stored in the transaction that creates the pass
+        pereval_id = await db_service.submit_pereval(pereval_data, idempotency_key)
 
     except Exception as e:
+        if idempotency_key is not None:
+            await idempotency.abandon(db, idempotency_key)
         return {
             "status": 500,
             "message": f"Error during operation: {str(e)}",
             "id": None
         }
 
-@app.get("/submitData/{id}", response_model=schemas.PerevalAddedResponse)
-async def get_pereval(id: int, db: Session = Depends(get_db)):
-    """Get pereval by ID"""
+    search.index_perevals(db, search_index, [(pereval_id, search.pereval_titles(pereval_data))])
+    image_processor.schedule(blob_storage, [image.img for image in pereval_data.images])
+    return services.submit_result(pereval_id)
+
+class MultipartTooLarge(MultiPartException):
+    """A multipart form has more files or larger files than allowed"""
+
+
+class LimitedMultiPartParser(MultiPartParser):
+    """Multipart parser that stops reading as soon as an image count or file size limit is exceeded"""
+
+    def __init__(self, headers, stream, max_upload_files: int, max_file_bytes: int):
+        super().__init__(headers, stream, max_files=float("inf"))
+        self.max_upload_files = max_upload_files
+        self.max_file_bytes = max_file_bytes
+        self._file_counts = {"data": 0, "images": 0}
+        self._current_file_bytes = 0
+
+    def on_headers_finished(self) -> None:
+        super().on_headers_finished()
+        self._current_file_bytes = 0
+        if self._current_part.file is None:
+            return
+        # The data part may also be sent as a file, it does not count as an image
+        kind = "data" if self._current_part.field_name == "data" else "images"
+        self._file_counts[kind] += 1
+        if self._file_counts["images"] > self.max_upload_files or self._file_counts["data"] > 1:
+            raise MultipartTooLarge(f"A request may contain at most {self.max_upload_files} image files")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._current_part.file is not None:
+            self._current_file_bytes += end - start
+            if self._current_file_bytes > self.max_file_bytes:
+                raise MultipartTooLarge(f"A file may be at most {self.max_file_bytes} bytes")
+        super().on_part_data(data, start, end)
+
+
+async def read_multipart_form(request: Request):
+    """Parse a multipart form, enforcing the file count and file size limits while it is streamed"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return await request.form()
+    if not content_type.startswith("multipart/form-data"):
+        raise MultiPartException("Request body must be a multipart or urlencoded form")
+    parser = LimitedMultiPartParser(request.headers, request.stream(), MULTIPART_MAX_FILES, MULTIPART_MAX_FILE_BYTES)
+    return await parser.parse()
+
+
+@app.post("/submitData/multipart", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["data"],
+            "properties": {
+                "data": {"type": "string"},
+                "images": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                "img_titles": {"type": "array", "items": {"type": "string"}},
+            },
+        }}},
+    },
+})
+async def submit_data_multipart(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    blob_storage: storage.BlobStorage = Depends(get_storage),
+    image_processor: imaging.ImageProcessor = Depends(get_image_processor),
+    search_index: search.SearchIndex = Depends(get_search_index),
+    reference_data: reference.ReferenceData = Depends(get_reference_data),
+):
+    """Create a new pereval from a JSON metadata part and streamed image files"""
     try:
-        db_service = services.DatabaseService(db)
+        form = await read_multipart_form(request)
+    except MultipartTooLarge as e:
+        return JSONResponse(status_code=413, content={
+            "status": 413,
+            "message": e.message,
+            "id": None
+        })
+    except MultiPartException as e:
+        return JSONResponse(status_code=400, content={
+            "status": 400,
+            "message": f"Invalid request body: {e.message}",
+            "id": None
+        })
+
+    try:
+        try:
+            data = form.get("data") or ""
+            if not isinstance(data, str):
+                data = await data.read()
+            pereval_data = schemas.PerevalAddedCreate.model_validate_json(data)
+        except ValidationError as e:
+            return JSONResponse(status_code=422, content={
+                "status": 422,
+                "message": f"Invalid pereval data: {e.errors(include_url=False, include_input=False)}",
+                "id": None
+            })
+
+        error = await reference_data.validate_pereval(db, pereval_data)
+        if error:
+            return JSONResponse(status_code=400, content={
+                "status": 400,
+                "message": error,
+                "id": None
+            })
+
+        images = form.getlist("images")
+        img_titles = form.getlist("img_titles")
+        try:
+            db_service = services.DatabaseService(db)
+
+            await store_images(pereval_data.images, blob_storage)
+            for index, upload in enumerate(images):
+                key = await run_in_threadpool(blob_storage.put_file, upload.file)
+                img_title = img_titles[index] if index < len(img_titles) else upload.filename
+                pereval_data.images.append(schemas.PerevalImagesCreate(img_title=img_title, img=key))
 
-        pereval = db_service.get_pereval_by_id(id)
-        
-        if not pereval:
+            pereval_id = await db_service.submit_pereval(pereval_data)
+            search.index_perevals(db, search_index, [(pereval_id, search.pereval_titles(pereval_data))])
+            image_processor.schedule(blob_storage, [image.img for image in pereval_data.images])
+
+            return services.submit_result(pereval_id)
+
+        except Exception as e:
             return {
-                "status": 404,
-                "message": f"Pereval with ID {id} not found",
+                "status": 500,
+                "message": f"Error during operation: {str(e)}",
                 "id": None
             }
-        return pereval
+    finally:
+        await form.close()
+
+async def read_bulk_items(request: Request):
+    """Read bulk items from a JSON array body or an NDJSON stream"""
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        items = []
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            items.extend(json.loads(line) for line in lines if line.strip())
+            if len(items) > BULK_MAX_ITEMS:
+                break
+        if buffer.strip():
+            items.append(json.loads(buffer))
+        return items
+
+    items = json.loads(await request.body())
+    if not isinstance(items, list):
+        raise ValueError("Request body must be a JSON array of perevals")
+    return items
+
+
+@app.post("/submitData/bulk")
+async def submit_data_bulk(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    blob_storage: storage.BlobStorage = Depends(get_storage),
+    image_processor: imaging.ImageProcessor = Depends(get_image_processor),
+    search_index: search.SearchIndex = Depends(get_search_index),
+    reference_data: reference.ReferenceData = Depends(get_reference_data),
+):
+    """Create many perevals from a JSON array or NDJSON body in one transaction"""
+    try:
+        items = await read_bulk_items(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={
+            "status": 400,
+            "message": f"Invalid request body: {str(e)}",
+            "results": []
+        })
+
+    if len(items) > BULK_MAX_ITEMS:
+        return JSONResponse(status_code=413, content={
+            "status": 413,
+            "message": f"A bulk request may contain at most {BULK_MAX_ITEMS} perevals",
+            "results": []
+        })
+
+    results = [{"index": index, "id": None, "error": None} for index in range(len(items))]
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            pereval_data = schemas.PerevalAddedCreate.model_validate(item)
+        except ValidationError as e:
+            results[index]["error"] = str(e.errors(include_url=False, include_input=False))
+            continue
+        error = await reference_data.validate_pereval(db, pereval_data)
+        if error:
+            results[index]["error"] = error
+        else:
+            valid.append((index, pereval_data))
+
+    try:
+        db_service = services.DatabaseService(db)
+
+        for index, pereval_data in valid:
+            await store_images(pereval_data.images, blob_storage)
+
+        pereval_ids = await db_service.submit_perevals([pereval_data for index, pereval_data in valid])
+        search.index_perevals(db, search_index, [
+            (pereval_id, search.pereval_titles(pereval_data))
+            for (index, pereval_data), pereval_id in zip(valid, pereval_ids)
+        ])
+        for (index, pereval_data), pereval_id in zip(valid, pereval_ids):
+            results[index]["id"] = pereval_id
+            image_processor.schedule(blob_storage, [image.img for image in pereval_data.images])
 
-    except Exception as e:
-        print(f"Error during request execution: {str(e)}")
         return {
+            "status": 200,
+            "message": f"{len(pereval_ids)} of {len(items)} perevals successfully created",
+            "results": results
+        }
+
+    except Exception as e:
+        for index, pereval_data in valid:
+            results[index]["error"] = f"Error during operation: {str(e)}"
+        return JSONResponse(status_code=500, content={
+            "status": 500,
+            "message": f"Error during operation: {str(e)}",
+            "results": results
+        })
+
+@app.get("/submitData/{id}", response_model=schemas.PerevalAddedResponse)
+async def get_pereval(
+    id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    response_cache: cache.CacheBackend = Depends(get_response_cache),
+):
+    """Get pereval by ID, answering 304 when the client copy is current"""
+    try:
+        cached = response_cache.get(cache.pereval_key(id))
+        if cached is None:
+            db_service = services.DatabaseService(db)
+
+            pereval = await db_service.get_pereval_by_id(id)
+
+            if not pereval:
+                return JSONResponse(status_code=404, content={
+                    "status": 404,
+                    "message": f"Pereval with ID {id} not found",
+                    "id": None
+                })
+
+            with instrumentation.serialization_timer():
+                body = serialization.dumps(schemas.PerevalAddedResponse, pereval)
+            cached = cache.CachedResponse(
+                body=body,
+                etag=pereval_etag(pereval),
+                last_modified=http_date(pereval.updated_at),
+                version=pereval.version,
+            )
+            response_cache.set(cache.pereval_key(id), cached)
+
+        headers = {"ETag": cached.etag, "Last-Modified": cached.last_modified}
+        if is_not_modified(request, cached):
+            return Response(status_code=304, headers=headers)
+        return Response(content=cached.body, media_type="application/json", headers=headers)
+
+    except Exception as e:
+        logger.exception("Error getting pereval %s", id)
+        return JSONResponse(status_code=500, content={
             "status": 500,
             "message": f"Error during operation: {str(e)}",
             "id": None
-        }
+        })
     
 @app.patch("/submitData/{id}")
-async def update_pereval(id: int, pereval_data: schemas.PerevalAddedCreate, db: Session = Depends(get_db)):
-    """Update pereval by ID"""
-    try:
-        db_service = services.DatabaseService(db)
+async def update_pereval(
+    id: int,
+    pereval_data: schemas.PerevalUpdate,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    blob_storage: storage.BlobStorage = Depends(get_storage),
+    image_processor: imaging.ImageProcessor = Depends(get_image_processor),
+    search_index: search.SearchIndex = Depends(get_search_index),
+    response_cache: cache.CacheBackend = Depends(get_response_cache),
+    reference_data: reference.ReferenceData = Depends(get_reference_data),
+):
+    """Change the fields sent in the request of a pereval by ID, rejecting stale If-Match preconditions with 412"""
+    precondition = None
+    if_match = request.headers.get("if-match")
+    if if_match is not None and if_match.strip() != "*":
+        tags = [tag.strip() for tag in if_match.split(",")]
+        precondition = lambda db_pereval: pereval_etag(db_pereval) in tags
 
-        db_pereval = db_service.get_pereval_by_id(id)
-        
-        if not db_pereval:
+    try:
+        error = await reference_data.validate_pereval(db, pereval_data)
+        if error:
             return {
                 "state": 0,
-                "message": f"Pereval with ID {id} not found",
+                "message": error,
             }
 
-        if db_pereval.status != "new":
+        if pereval_data.images is not None:
+            await store_images(pereval_data.images, blob_storage)
+
+        result = await services.DatabaseService(db).update_pereval(id, pereval_data, precondition)
+        if result is None:
             return {
                 "state": 0,
-                "message": "Pereval is not in 'new' status, editing is not allowed.",
+                "message": f"Pereval with ID {id} not found",
             }
+        updated, new_images = result
 
-        if pereval_data.title is not None:
-            db_pereval.title = pereval_data.title
-        if pereval_data.beauty_title is not None:
-            db_pereval.beauty_title = pereval_data.beauty_title
-        if pereval_data.other_titles is not None:
-            db_pereval.other_titles = pereval_data.other_titles
-        if pereval_data.connect is not None:
-            db_pereval.connect = pereval_data.connect
-        if pereval_data.add_time is not None:
-            db_pereval.add_time = pereval_data.add_time
-        if pereval_data.winter_level is not None:
-            db_pereval.winter_level = pereval_data.winter_level
-        if pereval_data.summer_level is not None:
-            db_pereval.summer_level = pereval_data.summer_level
-        if pereval_data.autumn_level is not None:
-            db_pereval.autumn_level = pereval_data.autumn_level
-        if pereval_data.spring_level is not None:
-            db_pereval.spring_level = pereval_data.spring_level
-
-        if pereval_data.coords is not None:
-            coords = db.query(models.Coords).filter(models.Coords.id == db_pereval.coord_id).first()
-
-            coords.latitude = pereval_data.coords.latitude
-            coords.longitude = pereval_data.coords.longitude
-            coords.height = pereval_data.coords.height
-
-            db.commit()
-
-
-        if pereval_data.images is not None:
-            db.query(models.PerevalImages).filter(models.PerevalImages.pereval_id == id).delete()
-            db.commit()
-
-            for image_data in pereval_data.images:
-                new_image = models.PerevalImages(
-                    pereval_id=id,
-                    img_title=image_data.img_title,
-                    img=image_data.img,
-                )
-                db.add(new_image)
-
-
-        db.commit()
-    
-
+    except services.PerevalNotEditable:
         return {
-            "state": 1,
-            "message": "Pereval successfully updated",
+            "state": 0,
+            "message": "Pereval is not in 'new' status, editing is not allowed.",
         }
-
+    except services.PreconditionFailed:
+        return JSONResponse(status_code=412, content={
+            "state": 0,
+            "message": "Pereval was modified, fetch it again before updating",
+        })
     except Exception as e:
         return {
             "state": 0,
             "message": f"Error updating pereval: {str(e)}",
         }
-    
-@app.get("/submitData/", response_model=List[schemas.PerevalAddedResponse])
-async def get_pereval_by_user(user_email: str, db: Session = Depends(get_db)):
-    """Get perevals by user email"""
+
+    response_cache.delete(cache.pereval_key(id), updated.version)
+    search.index_perevals(db, search_index, [(id, search.pereval_titles(updated))])
+    image_processor.schedule(blob_storage, new_images)
+
+    return JSONResponse(content={
+        "state": 1,
+        "message": "Pereval successfully updated",
+    }, headers={"ETag": pereval_etag(updated), "Last-Modified": http_date(updated.updated_at)})
+
+@app.get("/submitData/", response_model=Union[List[schemas.PerevalAddedResponse], List[schemas.PerevalSummaryResponse]])
+async def get_pereval_by_user(
+    user_email: str,
+    view: str = Query("full", pattern="^(full|summary)$"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Get a page of perevals by user email, the next page cursor is returned in X-Next-Cursor.
+
+    view=summary returns PerevalSummaryResponse items without user and images, with image counts instead.
+    """
     try:
         db_service = services.DatabaseService(db)
-        perevals = db_service.get_pereval_by_email(user_email)
+        if view == "summary":
+            get_perevals, schema = db_service.get_pereval_summaries_by_email, schemas.PerevalSummaryResponse
+        else:
+            get_perevals, schema = db_service.get_pereval_by_email, schemas.PerevalAddedResponse
+        perevals = await get_perevals(
+            user_email,
+            limit=limit + 1,
+            cursor=cursor,
+            status=status,
+            date_from=date_from,
+            date_to=date_to,
+        )
 
-        if not perevals:
-            return {
+        if not perevals and cursor is None:
+            return JSONResponse(status_code=404, content={
                 "status": 404,
                 "message": "Pereval not found",
                 "user_email": user_email
-            }
+            })
 
-        return perevals  
+        headers = {}
+        if len(perevals) > limit:
+            perevals = perevals[:limit]
+            headers["X-Next-Cursor"] = services.encode_cursor(perevals[-1])
+
+        return serialized_response(schema, perevals, many=True, headers=headers)
+
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={
+            "status": 400,
+            "message": str(e),
+            "user_email": user_email
+        })
 
     except Exception as e:
-        return {
+        return JSONResponse(status_code=500, content={
             "status": 500,
             "message": f"Error during operation: {str(e)}",
             "user_email": user_email
-        }
\ No newline at end of file
+        })
+
+
+@app.get("/sync", response_model=schemas.SyncResponse)
+async def sync_perevals(
+    user_email: str,
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """Get the user's perevals and status changes after the since cursor, pass the returned cursor next time"""
+    db_service = services.DatabaseService(db)
+    perevals, status_changes, cursor, has_more = await db_service.get_changes(user_email, since, limit)
+    return serialized_response(schemas.SyncResponse, SimpleNamespace(
+        cursor=cursor, has_more=has_more, perevals=perevals, status_changes=status_changes,
+    ))
+
+
+@app.post("/moderation/claim", response_model=List[schemas.PerevalAddedResponse])
+async def claim_perevals(
+    claim: schemas.ModerationClaim,
+    db: AsyncSession = Depends(get_db),
+    response_cache: cache.CacheBackend = Depends(get_response_cache),
+):
+    """Take the oldest new perevals for review, concurrent moderators get disjoint batches"""
+    db_service = services.DatabaseService(db)
+    perevals = await db_service.claim_perevals(claim.moderator, claim.limit)
+    for pereval in perevals:
+        response_cache.delete(cache.pereval_key(pereval.id), pereval.version)
+    return perevals
+
+
+@app.post("/moderation/transitions")
+async def transition_perevals(
+    transition: schemas.ModerationTransition,
+    db: AsyncSession = Depends(get_db),
+    response_cache: cache.CacheBackend = Depends(get_response_cache),
+):
+    """Move perevals to a new status, those not in the expected status or claimed by someone else are left as is"""
+    db_service = services.DatabaseService(db)
+    versions = await db_service.transition_perevals(transition.ids, transition.status, transition.moderator)
+    for pereval_id, version in versions.items():
+        response_cache.delete(cache.pereval_key(pereval_id), version)
+    moved_ids = list(versions)
+    return {
+        "state": 1,
+        "message": f"{len(moved_ids)} of {len(transition.ids)} perevals moved to '{transition.status}'",
+        "ids": moved_ids,
+    }
+
+
+def reference_response(request: Request, snapshot: reference.Snapshot, body: bytes) -> Response:
+    headers = {"ETag": snapshot.etag, "Cache-Control": reference.CACHE_CONTROL}
+    if request.headers.get("if-none-match", "").strip() in (snapshot.etag, "*"):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/reference/activities", response_model=List[schemas.ActivityTypeResponse])
+async def get_reference_activities(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    reference_data: reference.ReferenceData = Depends(get_reference_data),
+):
+    """Get all activity types from the in-process snapshot"""
+    snapshot = await reference_data.get(db)
+    return reference_response(request, snapshot, snapshot.activities_json)
+
+
+@app.get("/reference/areas", response_model=List[schemas.AreaResponse])
+async def get_reference_areas(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    reference_data: reference.ReferenceData = Depends(get_reference_data),
+):
+    """Get the whole area tree as a flat list from the in-process snapshot"""
+    snapshot = await reference_data.get(db)
+    return reference_response(request, snapshot, snapshot.areas_json)
+
+
+@app.get("/areas", response_model=List[schemas.AreaResponse])
+async def get_areas(parent_id: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    """Get the child areas of parent_id, or the root areas"""
+    db_service = services.DatabaseService(db)
+    return await db_service.get_areas(parent_id)
+
+
+@app.post("/areas", response_model=schemas.AreaResponse)
+async def create_area(
+    area_data: schemas.AreaCreate,
+    db: AsyncSession = Depends(get_db),
+    reference_data: reference.ReferenceData = Depends(get_reference_data),
+):
+    """Create an area"""
+    db_service = services.DatabaseService(db)
+    try:
+        area = await db_service.create_area(area_data)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": 400, "message": str(e)})
+    reference_data.invalidate()
+    return area
+
+
+@app.get("/areas/{area_id}", response_model=schemas.AreaResponse)
+async def get_area(area_id: int, db: AsyncSession = Depends(get_db)):
+    """Get an area by ID"""
+    db_service = services.DatabaseService(db)
+    area = await db_service.get_area(area_id)
+    if not area:
+        return JSONResponse(status_code=404, content={
+            "status": 404,
+            "message": f"Area with ID {area_id} not found",
+        })
+    return area
+
+
+@app.patch("/areas/{area_id}", response_model=schemas.AreaResponse)
+async def update_area(
+    area_id: int,
+    area_data: schemas.AreaUpdate,
+    db: AsyncSession = Depends(get_db),
+    reference_data: reference.ReferenceData = Depends(get_reference_data),
+):
+    """Rename an area or move it with all its descendants under another parent"""
+    db_service = services.DatabaseService(db)
+    area = await db_service.get_area(area_id)
+    if not area:
+        return JSONResponse(status_code=404, content={
+            "status": 404,
+            "message": f"Area with ID {area_id} not found",
+        })
+    try:
+        area = await db_service.update_area(area, area_data)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": 400, "message": str(e)})
+    reference_data.invalidate()
+    return area
+
+
+@app.get("/areas/{area_id}/perevals", response_model=List[schemas.PerevalAddedResponse])
+async def get_area_perevals(
+    area_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Get a page of perevals in an area and its subareas, the next after_id is returned in X-Next-Cursor"""
+    db_service = services.DatabaseService(db)
+    area = await db_service.get_area(area_id)
+    if not area:
+        return JSONResponse(status_code=404, content={
+            "status": 404,
+            "message": f"Area with ID {area_id} not found",
+        })
+
+    perevals = await db_service.get_perevals_in_area(area, limit + 1, after_id)
+    headers = {}
+    if len(perevals) > limit:
+        perevals = perevals[:limit]
+        headers["X-Next-Cursor"] = str(perevals[-1].id)
+    return serialized_response(schemas.PerevalAddedResponse, perevals, many=True, headers=headers)
+
+
+@app.get("/images/{image_id}")
+async def get_image(
+    image_id: int,
+    size: Optional[str] = Query(None, pattern=f"^({'|'.join(imaging.IMAGE_SIZES)})$"),
+    db: AsyncSession = Depends(get_db),
+    blob_storage: storage.BlobStorage = Depends(get_storage),
+):
+    """Stream the bytes of a pereval image, or of its resized variant when size is given"""
+    db_service = services.DatabaseService(db)
+    image = await db_service.get_image_by_id(image_id)
+    if not image:
+        return JSONResponse(status_code=404, content={
+            "status": 404,
+            "message": f"Image with ID {image_id} not found",
+        })
+
+    key = image.img
+    if size is not None and await run_in_threadpool(blob_storage.exists, storage.variant_key(key, size)):
+        key = storage.variant_key(key, size)
+
+    chunks = iterate_in_threadpool(blob_storage.iter_chunks(key))
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except storage.BlobNotFound:
+        return JSONResponse(status_code=404, content={
+            "status": 404,
+            "message": f"Image data for ID {image_id} not found",
+        })
+
+    async def body():
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type=storage.guess_content_type(first_chunk))
+
+
+def nearby_response(pairs):
+    """Serialize (distance_km, pereval) pairs"""
+    return [
+        schemas.PerevalNearbyResponse.model_validate(
+            schemas.PerevalAddedResponse.model_validate(pereval).model_dump() | {"distance_km": round(distance, 3)}
+        )
+        for distance, pereval in pairs
+    ]
+
+
+@app.get("/perevals/nearby", response_model=List[schemas.PerevalNearbyResponse])
+async def get_perevals_nearby(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(10, gt=0, le=1000),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """Get perevals within radius_km of a point, nearest first"""
+    db_service = services.DatabaseService(db)
+    pairs = await db_service.get_perevals_nearby(latitude, longitude, radius_km, limit)
+    return nearby_response(pairs)
+
+
+@app.get("/perevals/bbox", response_model=List[schemas.PerevalNearbyResponse])
+async def get_perevals_in_bbox(
+    min_latitude: float = Query(..., ge=-90, le=90),
+    min_longitude: float = Query(..., ge=-180, le=180),
+    max_latitude: float = Query(..., ge=-90, le=90),
+    max_longitude: float = Query(..., ge=-180, le=180),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """Get perevals inside a bounding box, nearest to its center first"""
+    if min_latitude > max_latitude or min_longitude > max_longitude:
+        return JSONResponse(status_code=400, content={
+            "status": 400,
+            "message": "min_latitude and min_longitude must not exceed max_latitude and max_longitude",
+        })
+
+    db_service = services.DatabaseService(db)
+    pairs = await db_service.get_perevals_in_bbox(min_latitude, min_longitude, max_latitude, max_longitude, limit)
+    return nearby_response(pairs)
+
+
+@app.get("/search", response_model=List[schemas.PerevalSearchResponse])
+async def search_perevals(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+    search_index: search.SearchIndex = Depends(get_search_index),
+):
+    """Search perevals by title, beauty title and other titles, tolerating misspellings"""
+    db_service = services.DatabaseService(db)
+    matches = await search.search(db, search_index, q, limit)
+    scores = {pereval_id: score for score, pereval_id in matches}
+    perevals = await db_service.get_perevals_by_ids(list(scores))
+    return [
+        schemas.PerevalSearchResponse.model_validate(
+            schemas.PerevalAddedResponse.model_validate(pereval).model_dump() | {"score": round(scores[pereval.id], 4)}
+        )
+        for pereval in perevals
+    ]
+
+
+@app.get("/tiles/{z}/{x}/{y}")
+async def get_tile(z: int, x: int, y: int, db: AsyncSession = Depends(get_db)):
+    """Get clustered pass markers of a map tile"""
+    if not 0 <= z <= 22 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return JSONResponse(status_code=404, content={
+            "status": 404,
+            "message": f"Tile {z}/{x}/{y} does not exist",
+        })
+
+    db_service = services.DatabaseService(db)
+    return {"z": z, "x": x, "y": y, "clusters": await db_service.get_tile(z, x, y)}
+
+
+@app.get("/export")
+async def export_perevals(
+    format: str = Query("ndjson", pattern=f"^({'|'.join(export.FORMATS)})$"),
+    session_factory=Depends(get_session_factory),
+):
+    """Stream all perevals with coords, users and image references as NDJSON or CSV"""
+    async def body():
+        async with session_factory() as db:
+            async for chunk in export.iter_export(db, format):
+                yield chunk
+
+    return StreamingResponse(body(), media_type=export.MEDIA_TYPES[format], headers={
+        "Content-Disposition": f"attachment; filename=perevals.{format}",
+    })
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose application metrics in the Prometheus text format"""
+    return metrics.registry.render()
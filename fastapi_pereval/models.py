@@ -1,7 +1,13 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, TIMESTAMP
+from sqlalchemy import BigInteger, Column, Integer, String, Text, ForeignKey, Float, TIMESTAMP, Index, event, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from .database import Base
+from . import geo
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class User(Base):
@@ -24,6 +30,13 @@ class Coords(Base):
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     height = Column(Integer, nullable=False)
+    geohash = Column(String(geo.PRECISION), nullable=True, index=True)
+
+
+@event.listens_for(Coords, "before_insert")
+@event.listens_for(Coords, "before_update")
+def set_coords_geohash(mapper, connection, target):
+    target.geohash = geo.encode(target.latitude, target.longitude)
 
 
 class PerevalAdded(Base):
@@ -32,6 +45,7 @@ class PerevalAdded(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     coord_id = Column(Integer, ForeignKey("coords.id"))
+    area_id = Column(Integer, ForeignKey("pereval_areas.id"), nullable=True, index=True)
 
     beauty_title = Column(String, nullable=True)
     title = Column(String, nullable=False)
@@ -45,17 +59,92 @@ class PerevalAdded(Base):
     spring_level = Column(String, nullable=True)
 
     status = Column(String, default="new")  # new | pending | accepted | rejected
+    claimed_by = Column(String, nullable=True)  # moderator who took the pass for review
+
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(TIMESTAMP, nullable=False, default=utcnow, onupdate=utcnow, server_default=func.now())
+    change_seq = Column(BigInteger, nullable=False, default=0)  # position in the change feed, set by changes.stamp
 
     user = relationship("User", back_populates="perevals")
     coords = relationship("Coords")
     images = relationship("PerevalImages", back_populates="pereval")
 
+    __table_args__ = (
+        Index("ix_pereval_added_user_id_add_time_id", "user_id", "add_time", "id"),
+        Index("ix_pereval_added_user_id_change_seq", "user_id", "change_seq"),
+        # Moderation queue, stays as small as the backlog of unreviewed passes
+        Index(
+            "ix_pereval_added_new_id", "id",
+            postgresql_where=text("status = 'new'"), sqlite_where=text("status = 'new'"),
+        ),
+    )
+
+
+class PerevalStatusChange(Base):
+    """Status history of a pass, ordered by the change feed sequence"""
+    __tablename__ = "pereval_status_changes"
+
+    id = Column(Integer, primary_key=True)
+    pereval_id = Column(Integer, ForeignKey("pereval_added.id"), nullable=False)
+    status = Column(String, nullable=False)
+    changed_at = Column(TIMESTAMP, nullable=False, default=utcnow, server_default=func.now())
+    change_seq = Column(BigInteger, nullable=False, index=True)
+
+
+class ChangeCounter(Base):
+    """Single-row counter that hands out change feed sequence numbers in commit order"""
+    __tablename__ = "change_counter"
+
+    id = Column(Integer, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """Stored response of a POST made with an Idempotency-Key header"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)  # None while the first request is in progress
+    response = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP, nullable=False, default=utcnow)
+    expires_at = Column(TIMESTAMP, nullable=False, index=True)
+
+
+class TileCluster(Base):
+    """Per-zoom marker aggregate of the passes in one map cell"""
+    __tablename__ = "tile_clusters"
+
+    zoom = Column(Integer, primary_key=True)
+    cell_x = Column(Integer, primary_key=True)
+    cell_y = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum_latitude = Column(Float, nullable=False, default=0)
+    sum_longitude = Column(Float, nullable=False, default=0)
+
+
+class TileClusterDelta(Base):
+    """Queued change of a tile cluster aggregate, folded into tile_clusters in the background"""
+    __tablename__ = "tile_cluster_deltas"
+
+    id = Column(Integer, primary_key=True)
+    zoom = Column(Integer, nullable=False)
+    cell_x = Column(Integer, nullable=False)
+    cell_y = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
+    sum_latitude = Column(Float, nullable=False)
+    sum_longitude = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tile_cluster_deltas_cell", "zoom", "cell_x", "cell_y"),
+    )
+
 
 class PerevalImages(Base):
     __tablename__ = "pereval_images"
 
     id = Column(Integer, primary_key=True, index=True)
-    pereval_id = Column(Integer, ForeignKey("pereval_added.id"))
+    pereval_id = Column(Integer, ForeignKey("pereval_added.id"), index=True)
     img_title = Column(String, nullable=True)  
     img = Column(String, nullable=False)  
 
@@ -68,6 +157,11 @@ class PerevalAreas(Base):
     id = Column(Integer, primary_key=True, index=True)
     id_parent = Column(Integer, nullable=True)
     title = Column(String, nullable=False)
+    path = Column(String, nullable=True)  # materialized path, see areas.py
+
+    __table_args__ = (
+        Index("ix_pereval_areas_path", "path", postgresql_ops={"path": "text_pattern_ops"}),
+    )
 
 
 class SprActivitiesTypes(Base):
@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache
+from typing import FrozenSet, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+
+from . import models
+
+REFERENCE_TTL = float(os.getenv("FSTR_REFERENCE_TTL", "300"))
+CACHE_CONTROL = "public, max-age=3600"
+
+
+class Snapshot(NamedTuple):
+    """Immutable copy of the reference tables, with their JSON bodies serialized once"""
+    version: str
+    activities: Tuple[dict, ...]
+    areas: Tuple[dict, ...]
+    area_ids: FrozenSet[int]
+    activities_json: bytes
+    areas_json: bytes
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version}"'
+
+
+def build_snapshot(activities, areas) -> Snapshot:
+    activities_json = json.dumps(activities, ensure_ascii=False).encode()
+    areas_json = json.dumps(areas, ensure_ascii=False).encode()
+    return Snapshot(
+        version=hashlib.sha256(activities_json + b"\n" + areas_json).hexdigest()[:16],
+        activities=tuple(activities),
+        areas=tuple(areas),
+        area_ids=frozenset(area["id"] for area in areas),
+        activities_json=activities_json,
+        areas_json=areas_json,
+    )
+
+
+class ReferenceData:
+    """Holds the current snapshot and swaps it for a new one when the tables change"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.snapshot: Optional[Snapshot] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _expired(self) -> bool:
+        return self.snapshot is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def invalidate(self):
+        """Reload on next use, call after writing to the reference tables"""
+        self._loaded_at = float("-inf")
+
+    async def refresh(self, db) -> Snapshot:
+        activities = (await db.execute(
+            select(models.SprActivitiesTypes.id, models.SprActivitiesTypes.title)
+            .order_by(models.SprActivitiesTypes.id)
+        )).mappings().all()
+        areas = (await db.execute(
+            select(
+                models.PerevalAreas.id,
+                models.PerevalAreas.id_parent,
+                models.PerevalAreas.title,
+                models.PerevalAreas.path,
+            ).order_by(models.PerevalAreas.id)
+        )).mappings().all()
+
+        snapshot = build_snapshot([dict(row) for row in activities], [dict(row) for row in areas])
+        # Keep the old object when nothing changed so its version stays the same
+        if self.snapshot is None or snapshot.version != self.snapshot.version:
+            self.snapshot = snapshot
+        self._loaded_at = time.monotonic()
+        return self.snapshot
+
+    async def get(self, db) -> Snapshot:
+        """Get the snapshot, reloading it at most once per ttl seconds"""
+        if self._expired():
+            async with self._lock:
+                if self._expired():
+                    await self.refresh(db)
+        return self.snapshot
+
+    async def validate_pereval(self, db, pereval_data) -> Optional[str]:
+        """Get an error message if a pass refers to unknown reference data.
+
+        Another worker may have added an area since the snapshot was loaded, so an area missing
+        from it is looked up by id before the pass is rejected, and the snapshot is reloaded.
+        """
+        error = validate_pereval(await self.get(db), pereval_data)
+        if error and await db.get(models.PerevalAreas, pereval_data.area_id) is not None:
+            self.invalidate()
+            return None
+        return error
+
+
+def validate_pereval(snapshot: Snapshot, pereval_data) -> Optional[str]:
+    """Get an error message if a pass refers to unknown reference data"""
+    if pereval_data.area_id is not None and pereval_data.area_id not in snapshot.area_ids:
+        return f"Area with ID {pereval_data.area_id} not found"
+    return None
+
+
+@lru_cache
+def get_reference_data() -> ReferenceData:
+    return ReferenceData(REFERENCE_TTL)
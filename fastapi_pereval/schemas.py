@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr,  ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr,  ConfigDict, Field, field_validator
+from typing import List, Literal, Optional
 from datetime import datetime
 
 
@@ -52,6 +52,32 @@ class PerevalImagesResponse(PerevalImagesCreate):
         from_attributes = True 
 
 
+class ActivityTypeResponse(BaseModel):
+    id: int
+    title: str
+
+    class Config(ConfigDict): 
+        from_attributes = True 
+
+
+class AreaCreate(BaseModel):
+    title: str
+    id_parent: Optional[int] = None
+
+
+class AreaUpdate(BaseModel):
+    title: Optional[str] = None
+    id_parent: Optional[int] = None
+
+
+class AreaResponse(AreaCreate):
+    id: int
+    path: str
+
+    class Config(ConfigDict): 
+        from_attributes = True 
+
+
 class PerevalAddedCreate(BaseModel):
     beauty_title: Optional[str] = None
     title: str
@@ -64,6 +90,7 @@ class PerevalAddedCreate(BaseModel):
     summer_level: Optional[str] = None
     autumn_level: Optional[str] = None
     spring_level: Optional[str] = None
+    area_id: Optional[int] = None
 
     images: List[PerevalImagesCreate] = []
 
@@ -71,19 +98,50 @@ class PerevalAddedCreate(BaseModel):
         from_attributes = True 
         
 
+class PerevalImageUpdate(BaseModel):
+    id: Optional[int] = None
+    img_title: Optional[str] = None
+    img: str
+
+
+class PerevalUpdate(BaseModel):
+    """Fields of a pass to change, fields left out of the request are kept as they are"""
+    beauty_title: Optional[str] = None
+    title: Optional[str] = None
+    other_titles: Optional[str] = None
+    connect: Optional[str] = None
+    add_time: Optional[datetime] = None
+    coords: Optional[CoordsCreate] = None
+    winter_level: Optional[str] = None
+    summer_level: Optional[str] = None
+    autumn_level: Optional[str] = None
+    spring_level: Optional[str] = None
+    area_id: Optional[int] = None
+
+    images: Optional[List[PerevalImageUpdate]] = None
+
+    @field_validator("title", "add_time", "coords", "images")
+    @classmethod
+    def not_null(cls, value):
+        # Validators only run for fields present in the request, so these may be omitted but not cleared
+        if value is None:
+            raise ValueError("may be omitted but not null")
+        return value
+
+
 class PerevalAddedResponse(PerevalAddedCreate):
     id: int
     add_time: datetime
     status: str
 
     title: str
-    beauty_title: str
-    other_titles: str
-    connect: str
-    winter_level: str
-    summer_level: str
-    autumn_level: str
-    spring_level: str
+    beauty_title: Optional[str]
+    other_titles: Optional[str]
+    connect: Optional[str]
+    winter_level: Optional[str]
+    summer_level: Optional[str]
+    autumn_level: Optional[str]
+    spring_level: Optional[str]
 
     user: UserResponse
     coords: CoordsResponse
@@ -93,3 +151,58 @@ class PerevalAddedResponse(PerevalAddedCreate):
         from_attributes = True 
 
 
+class PerevalSummaryResponse(BaseModel):
+    id: int
+    title: str
+    beauty_title: Optional[str]
+    status: str
+    add_time: datetime
+    area_id: Optional[int]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    height: Optional[int]
+    image_count: int
+
+    class Config(ConfigDict): 
+        from_attributes = True 
+
+
+class PerevalNearbyResponse(PerevalAddedResponse):
+    distance_km: float
+
+    class Config(ConfigDict): 
+        from_attributes = True 
+
+
+class PerevalSearchResponse(PerevalAddedResponse):
+    score: float
+
+    class Config(ConfigDict): 
+        from_attributes = True 
+
+
+class StatusChangeResponse(BaseModel):
+    pereval_id: int
+    status: str
+    changed_at: datetime
+
+    class Config(ConfigDict): 
+        from_attributes = True 
+
+
+class SyncResponse(BaseModel):
+    cursor: int
+    has_more: bool
+    perevals: List[PerevalAddedResponse]
+    status_changes: List[StatusChangeResponse]
+
+
+class ModerationClaim(BaseModel):
+    moderator: str
+    limit: int = Field(20, ge=1, le=100)
+
+
+class ModerationTransition(BaseModel):
+    moderator: str
+    ids: List[int]
+    status: Literal["pending", "accepted", "rejected", "new"]
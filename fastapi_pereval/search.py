@@ -0,0 +1,127 @@
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, text
+
+from . import models
+
+MIN_SIMILARITY = 0.3
+
+# Must match the indexed expressions created by the search migration
+SEARCH_DOCUMENT = "(coalesce(title, '') || ' ' || coalesce(beauty_title, '') || ' ' || coalesce(other_titles, ''))"
+
+POSTGRES_SEARCH_QUERY = text(f"""
+    SELECT id, greatest(
+        ts_rank(to_tsvector('simple', {SEARCH_DOCUMENT}), plainto_tsquery('simple', :query)),
+        word_similarity(:query, {SEARCH_DOCUMENT})
+    ) AS score
+    FROM pereval_added
+    WHERE to_tsvector('simple', {SEARCH_DOCUMENT}) @@ plainto_tsquery('simple', :query)
+       OR :query <% {SEARCH_DOCUMENT}
+    ORDER BY score DESC, id
+    LIMIT :limit
+""")
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(value: str) -> List[str]:
+    """Split a title into lowercase words"""
+    return _WORD_RE.findall(value.lower().replace("ё", "е"))
+
+
+def trigrams(value: str) -> Set[str]:
+    """Get the trigrams of every word, padded the way pg_trgm does it"""
+    result = set()
+    for word in normalize(value):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class SearchIndex:
+    """In-process trigram inverted index over pass titles, used when Postgres search is unavailable"""
+
+    def __init__(self):
+        self.ready = False
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._documents: Dict[int, Set[str]] = {}
+
+    def add(self, pereval_id: int, titles: Iterable[Optional[str]]):
+        """Index or re-index the titles of a pass"""
+        self.remove(pereval_id)
+        document = trigrams(" ".join(title for title in titles if title))
+        self._documents[pereval_id] = document
+        for trigram in document:
+            self._postings[trigram].add(pereval_id)
+
+    def remove(self, pereval_id: int):
+        for trigram in self._documents.pop(pereval_id, ()):
+            self._postings[trigram].discard(pereval_id)
+
+    def search(self, query: str, limit: int) -> List[Tuple[float, int]]:
+        """Get (score, pereval_id) pairs ranked by the share of query trigrams found in the titles"""
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for pereval_id in self._postings.get(trigram, ()):
+                shared[pereval_id] += 1
+
+        matches = []
+        for pereval_id, count in shared.items():
+            score = count / len(query_trigrams)
+            if score >= MIN_SIMILARITY:
+                matches.append((-score, pereval_id))
+        return [(-score, pereval_id) for score, pereval_id in sorted(matches)[:limit]]
+
+    async def build(self, db):
+        """Load the titles of all passes into the index"""
+        result = await db.stream(
+            select(
+                models.PerevalAdded.id,
+                models.PerevalAdded.title,
+                models.PerevalAdded.beauty_title,
+                models.PerevalAdded.other_titles,
+            ).execution_options(yield_per=1000)
+        )
+        async for pereval_id, *titles in result:
+            self.add(pereval_id, titles)
+        self.ready = True
+
+
+@lru_cache
+def get_search_index() -> SearchIndex:
+    return SearchIndex()
+
+
+def pereval_titles(pereval) -> Tuple[Optional[str], ...]:
+    """Get the searchable titles of a pass schema or model"""
+    return pereval.title, pereval.beauty_title, pereval.other_titles
+
+
+def uses_postgres(db) -> bool:
+    return db.bind.dialect.name == "postgresql"
+
+
+def index_perevals(db, index: SearchIndex, perevals: Iterable[Tuple[int, Iterable[Optional[str]]]]):
+    """Keep the in-process index in sync after passes are written"""
+    if uses_postgres(db) or not index.ready:
+        return
+    for pereval_id, titles in perevals:
+        index.add(pereval_id, titles)
+
+
+async def search(db, index: SearchIndex, query: str, limit: int) -> List[Tuple[float, int]]:
+    """Get (score, pereval_id) pairs for a query, best matches first"""
+    if uses_postgres(db):
+        result = await db.execute(POSTGRES_SEARCH_QUERY, {"query": query, "limit": limit})
+        return [(row.score, row.id) for row in result]
+
+    if not index.ready:
+        await index.build(db)
+    return index.search(query, limit)
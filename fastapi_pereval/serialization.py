@@ -0,0 +1,57 @@
+import typing
+from functools import lru_cache
+from typing import Any, Callable, Iterable, Type
+
+import orjson
+from pydantic import BaseModel
+
+
+def _identity(value):
+    return value
+
+
+def _converter(annotation) -> Callable[[Any], Any]:
+    """Get a function that turns an attribute value into the JSON-ready value of a field annotation"""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        arguments = [argument for argument in typing.get_args(annotation) if argument is not type(None)]
+        if len(arguments) == 1:
+            convert = _converter(arguments[0])
+            if convert is _identity:
+                return _identity
+            return lambda value: None if value is None else convert(value)
+        return _identity
+    if origin in (list, typing.List):
+        convert = _converter(typing.get_args(annotation)[0])
+        if convert is _identity:
+            return list
+        return lambda values: [convert(value) for value in values]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return compile_serializer(annotation)
+    return _identity
+
+
+@lru_cache
+def compile_serializer(model: Type[BaseModel]) -> Callable[[Any], dict]:
+    """Build a function that reads the fields of a schema straight from an ORM object into a dict.
+
+    Unlike model_validate(...).model_dump() nothing is validated: the objects come from our own
+    database, whose columns already have the types the schema declares.
+    """
+    fields = [(name, _converter(field.annotation)) for name, field in model.model_fields.items()]
+
+    def serialize(obj) -> dict:
+        return {name: convert(getattr(obj, name)) for name, convert in fields}
+
+    return serialize
+
+
+def dumps(model: Type[BaseModel], obj) -> bytes:
+    """Serialize one ORM object as the JSON of a schema"""
+    return orjson.dumps(compile_serializer(model)(obj))
+
+
+def dumps_many(model: Type[BaseModel], objs: Iterable) -> bytes:
+    """Serialize ORM objects as a JSON array of a schema"""
+    serialize = compile_serializer(model)
+    return orjson.dumps([serialize(obj) for obj in objs])
@@ -1,31 +1,90 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import and_, bindparam, delete, func, insert, or_, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from . import areas, changes, geo, idempotency, models, schemas, tiles
+
+
+# Lock order of every write transaction, so concurrent writers cannot deadlock:
+# 1. pereval_added rows, in ascending id order, taken first with SELECT ... FOR UPDATE
+# 2. tile_clusters rows, in sorted cell order; only tiles.fold_deltas takes them, writers queue deltas
+# 3. the change_counter row, taken by changes.stamp as the last statement before commit
+# Moderation moves: target status -> status the pass must be in
+MODERATION_TRANSITIONS = {"pending": "new", "accepted": "pending", "rejected": "pending", "new": "pending"}
+
+
+class PerevalNotEditable(Exception):
+    """The pass has left the 'new' status and can no longer be changed by its author"""
+
+
+class PreconditionFailed(Exception):
+    """The pass was changed since the client read it"""
+
+
+def submit_result(pereval_id: int) -> dict:
+    """Body of a successful POST /submitData, also stored for retries with its Idempotency-Key"""
+    return {
+        "status": 200,
+        "message": "Pereval successfully created",
+        "id": pereval_id
+    }
+
+
+def pereval_load_options(user_loader=joinedload):
+    """Loader options that fetch everything PerevalAddedResponse serializes"""
+    return (
+        user_loader(models.PerevalAdded.user),
+        joinedload(models.PerevalAdded.coords),
+        selectinload(models.PerevalAdded.images),
+    )
+
+
+def coords_values(coords_data: schemas.CoordsCreate) -> dict:
+    """Column values for a coords row, including its geohash"""
+    return coords_data.model_dump() | {"geohash": geo.encode(coords_data.latitude, coords_data.longitude)}
+
+
+def encode_cursor(pereval: models.PerevalAdded) -> str:
+    """Encode the keyset position of a pereval as an opaque cursor"""
+    raw = f"{pereval.add_time.isoformat()}|{pereval.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Decode a cursor into its (add_time, id) keyset position"""
+    try:
+        add_time, pereval_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(add_time), int(pereval_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
 
 
 class DatabaseService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def create_user(self, user_data: schemas.UserCreate):
-        """Create a new user in the database"""
+    async def create_user(self, user_data: schemas.UserCreate):
+        """Add a new user to the current transaction"""
         db_user = models.User(**user_data.model_dump())
         self.db.add(db_user)
-        self.db.commit()
-        self.db.refresh(db_user)
+        await self.db.flush()
         return db_user
-    
-    def create_coords(self, coords_data: schemas.CoordsCreate):
-        """Create a new coords in the database"""
+
+    async def create_coords(self, coords_data: schemas.CoordsCreate):
+        """Add a new coords to the current transaction"""
         db_coords = models.Coords(**coords_data.model_dump())
         self.db.add(db_coords)
-        self.db.commit()
-        self.db.refresh(db_coords)
+        await self.db.flush()
         return db_coords
-    
-    def create_pereval(self, pereval_data: schemas.PerevalAddedCreate, user_id: int, coords_id: int):
-        """Create a new pereval_added in the database"""
+
+    async def create_pereval(self, pereval_data: schemas.PerevalAddedCreate, user_id: int, coords_id: int):
+        """Add a new pereval_added to the current transaction"""
         db_pereval_added = models.PerevalAdded(
-            user_id=user_id,  
+            user_id=user_id,
             coord_id=coords_id,
             beauty_title = pereval_data.beauty_title,
             title = pereval_data.title,
@@ -40,34 +99,562 @@ class DatabaseService:
         )
 
         self.db.add(db_pereval_added)
-        self.db.commit()
-        self.db.refresh(db_pereval_added)
+        await self.db.flush()
+        await changes.stamp(self.db, [db_pereval_added.id])
+        await self.db.refresh(db_pereval_added, ["change_seq"])
         return db_pereval_added
-    
-    def create_pereval_images(self, pereval_images_data: schemas.PerevalImagesCreate):
-        """Create a new pereval_images in the database"""
+
+    async def create_pereval_images(self, pereval_images_data: schemas.PerevalImagesCreate):
+        """Add a new pereval_images to the current transaction"""
         db_pereval_images = models.PerevalImages(
             pereval_id = pereval_images_data.pereval_id,
             img_title = pereval_images_data.img_title,
             img = pereval_images_data.img,
         )
         self.db.add(db_pereval_images)
-        self.db.commit()
-        self.db.refresh(db_pereval_images)
+        await self.db.flush()
         return db_pereval_images
-    
-    def get_user_by_email(self, email: str):
+
+    async def get_user_by_email(self, email: str):
         """Get a user by email"""
-        return self.db.query(models.User).filter(models.User.email == email).first()
-    
-    def get_pereval_by_id(self, pereval_id: int):
+        result = await self.db.execute(select(models.User).where(models.User.email == email))
+        return result.scalars().first()
+
+    async def get_image_by_id(self, image_id: int):
+        """Get a pereval image by id"""
+        return await self.db.get(models.PerevalImages, image_id)
+
+    async def get_pereval_by_id(self, pereval_id: int):
         """Get a pereval by id"""
-        return self.db.query(models.PerevalAdded).filter(models.PerevalAdded.id == pereval_id).first()
-    
-    def get_pereval_by_email(self, user_email: str):
-        """Get a perevals by email"""
-        user = self.db.query(models.User).filter(models.User.email == user_email).first()
-        if user:
-            perevals = self.db.query(models.PerevalAdded).filter(models.PerevalAdded.user_id == user.id).all()
-            return perevals
-        return None
\ No newline at end of file
+        result = await self.db.execute(
+            select(models.PerevalAdded)
+            .options(*pereval_load_options())
+            .where(models.PerevalAdded.id == pereval_id)
+        )
+        return result.scalars().first()
+
+    def _user_perevals(
+        self,
+        query,
+        user_email: str,
+        limit: Optional[int],
+        cursor: Optional[str],
+        status: Optional[str],
+        date_from: Optional[datetime],
+        date_to: Optional[datetime],
+    ):
+        """Restrict a query joined with users to a page of the user's perevals ordered by (add_time, id)"""
+        query = (
+            query
+            .where(models.User.email == user_email)
+            .order_by(models.PerevalAdded.add_time, models.PerevalAdded.id)
+        )
+        if cursor is not None:
+            add_time, pereval_id = decode_cursor(cursor)
+            query = query.where(or_(
+                models.PerevalAdded.add_time > add_time,
+                and_(models.PerevalAdded.add_time == add_time, models.PerevalAdded.id > pereval_id),
+            ))
+        if status is not None:
+            query = query.where(models.PerevalAdded.status == status)
+        if date_from is not None:
+            query = query.where(models.PerevalAdded.add_time >= date_from)
+        if date_to is not None:
+            query = query.where(models.PerevalAdded.add_time < date_to)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    async def get_pereval_by_email(
+        self,
+        user_email: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+    ):
+        """Get a page of perevals by email ordered by (add_time, id)"""
+        query = (
+            select(models.PerevalAdded)
+            .join(models.PerevalAdded.user)
+            .options(*pereval_load_options(user_loader=contains_eager))
+        )
+        query = self._user_perevals(query, user_email, limit, cursor, status, date_from, date_to)
+        result = await self.db.execute(query)
+        return result.scalars().all()
+
+    async def get_pereval_summaries_by_email(
+        self,
+        user_email: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+    ):
+        """Get a page of PerevalSummaryResponse rows by email, reading only the summary columns and image counts"""
+        image_count = (
+            select(func.count(models.PerevalImages.id))
+            .where(models.PerevalImages.pereval_id == models.PerevalAdded.id)
+            .scalar_subquery()
+        )
+        query = (
+            select(
+                models.PerevalAdded.id,
+                models.PerevalAdded.title,
+                models.PerevalAdded.beauty_title,
+                models.PerevalAdded.status,
+                models.PerevalAdded.add_time,
+                models.PerevalAdded.area_id,
+                models.Coords.latitude,
+                models.Coords.longitude,
+                models.Coords.height,
+                image_count.label("image_count"),
+            )
+            .join(models.PerevalAdded.user)
+            .outerjoin(models.PerevalAdded.coords)
+        )
+        query = self._user_perevals(query, user_email, limit, cursor, status, date_from, date_to)
+        result = await self.db.execute(query)
+        return result.all()
+
+    async def get_changes(self, user_email: str, since: int, limit: int):
+        """Get a page of a user's perevals changed after the since cursor, the status changes up to the
+        last of them, the next cursor and whether more changes follow"""
+        result = await self.db.execute(
+            select(models.PerevalAdded)
+            .join(models.PerevalAdded.user)
+            .options(*pereval_load_options(user_loader=contains_eager))
+            .where(models.User.email == user_email, models.PerevalAdded.change_seq > since)
+            .order_by(models.PerevalAdded.change_seq)
+            .limit(limit + 1)
+        )
+        perevals = result.scalars().all()
+        has_more = len(perevals) > limit
+        perevals = perevals[:limit]
+        if not perevals:
+            return [], [], since, False
+
+        cursor = perevals[-1].change_seq
+        result = await self.db.execute(
+            select(models.PerevalStatusChange)
+            .join(models.PerevalAdded, models.PerevalAdded.id == models.PerevalStatusChange.pereval_id)
+            .join(models.PerevalAdded.user)
+            .where(
+                models.User.email == user_email,
+                models.PerevalStatusChange.change_seq > since,
+                models.PerevalStatusChange.change_seq <= cursor,
+            )
+            .order_by(models.PerevalStatusChange.change_seq, models.PerevalStatusChange.id)
+        )
+        return perevals, result.scalars().all(), cursor, has_more
+
+    async def get_area(self, area_id: int):
+        """Get an area by id"""
+        return await self.db.get(models.PerevalAreas, area_id)
+
+    async def get_areas(self, parent_id: Optional[int] = None):
+        """Get the child areas of a parent, or the root areas"""
+        query = select(models.PerevalAreas).order_by(models.PerevalAreas.title, models.PerevalAreas.id)
+        if parent_id is None:
+            query = query.where(or_(models.PerevalAreas.id_parent.is_(None), models.PerevalAreas.id_parent == 0))
+        else:
+            query = query.where(models.PerevalAreas.id_parent == parent_id)
+        result = await self.db.execute(query)
+        return result.scalars().all()
+
+    async def create_area(self, area_data: schemas.AreaCreate):
+        """Create an area under an existing parent, or a root area"""
+        parent = None
+        if area_data.id_parent:
+            parent = await self.get_area(area_data.id_parent)
+            if parent is None:
+                raise ValueError(f"Parent area with ID {area_data.id_parent} not found")
+
+        try:
+            db_area = models.PerevalAreas(title=area_data.title, id_parent=area_data.id_parent)
+            self.db.add(db_area)
+            await self.db.flush()
+            db_area.path = areas.child_path(parent.path if parent else None, db_area.id)
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+        return db_area
+
+    async def update_area(self, db_area: models.PerevalAreas, area_data: schemas.AreaUpdate):
+        """Rename an area or move it with its subtree under another parent"""
+        try:
+            if area_data.title is not None:
+                db_area.title = area_data.title
+            if "id_parent" in area_data.model_fields_set and (area_data.id_parent or None) != (db_area.id_parent or None):
+                parent = None
+                if area_data.id_parent:
+                    parent = await self.get_area(area_data.id_parent)
+                    if parent is None:
+                        raise ValueError(f"Parent area with ID {area_data.id_parent} not found")
+                    if parent.path.startswith(db_area.path):
+                        raise ValueError("An area cannot be moved into its own subtree")
+
+                old_path = db_area.path
+                db_area.id_parent = area_data.id_parent
+                db_area.path = areas.child_path(parent.path if parent else None, db_area.id)
+                await self.db.flush()
+                await areas.move_subtree(self.db, old_path, db_area.path)
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+        return db_area
+
+    async def get_perevals_in_area(self, db_area: models.PerevalAreas, limit: int, after_id: Optional[int] = None):
+        """Get a page of perevals of an area and all its descendants ordered by id"""
+        query = (
+            select(models.PerevalAdded)
+            .join(models.PerevalAreas, models.PerevalAdded.area_id == models.PerevalAreas.id)
+            .options(*pereval_load_options())
+            .where(areas.in_subtree(db_area.path))
+            .order_by(models.PerevalAdded.id)
+            .limit(limit)
+        )
+        if after_id is not None:
+            query = query.where(models.PerevalAdded.id > after_id)
+        result = await self.db.execute(query)
+        return result.scalars().all()
+
+    async def get_perevals_by_ids(self, pereval_ids: List[int]):
+        """Get perevals by ids in the given order"""
+        result = await self.db.execute(
+            select(models.PerevalAdded)
+            .options(*pereval_load_options())
+            .where(models.PerevalAdded.id.in_(pereval_ids))
+        )
+        perevals = {pereval.id: pereval for pereval in result.scalars()}
+        return [perevals[pereval_id] for pereval_id in pereval_ids if pereval_id in perevals]
+
+    async def _get_nearest(
+        self, prefixes: List[str], conditions: list, latitude: float, longitude: float, limit: int,
+        max_distance_km: Optional[float] = None,
+    ):
+        """Get (distance_km, pereval) pairs among geohash prefix candidates, nearest first"""
+        query = (
+            select(models.PerevalAdded.id, models.Coords.latitude, models.Coords.longitude)
+            .join(models.Coords, models.PerevalAdded.coord_id == models.Coords.id)
+            .where(*conditions)
+        )
+        if prefixes:
+            query = query.where(or_(*(
+                and_(models.Coords.geohash >= prefix, models.Coords.geohash < prefix + geo.PREFIX_END)
+                for prefix in prefixes
+            )))
+
+        candidates = sorted(
+            (geo.haversine_km(latitude, longitude, row.latitude, row.longitude), row.id)
+            for row in await self.db.execute(query)
+        )
+        if max_distance_km is not None:
+            candidates = [candidate for candidate in candidates if candidate[0] <= max_distance_km]
+        distances = dict((pereval_id, distance) for distance, pereval_id in candidates[:limit])
+
+        perevals = await self.get_perevals_by_ids(list(distances))
+        return [(distances[pereval.id], pereval) for pereval in perevals]
+
+    async def get_perevals_nearby(self, latitude: float, longitude: float, radius_km: float, limit: int):
+        """Get (distance_km, pereval) pairs within radius_km of a point, nearest first"""
+        return await self._get_nearest(
+            geo.radius_prefixes(latitude, longitude, radius_km), [], latitude, longitude, limit,
+            max_distance_km=radius_km,
+        )
+
+    async def get_perevals_in_bbox(
+        self, min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float, limit: int,
+    ):
+        """Get (distance_km, pereval) pairs inside a bounding box, nearest to its center first"""
+        return await self._get_nearest(
+            geo.bbox_prefixes(min_latitude, min_longitude, max_latitude, max_longitude),
+            [
+                models.Coords.latitude.between(min_latitude, max_latitude),
+                models.Coords.longitude.between(min_longitude, max_longitude),
+            ],
+            (min_latitude + max_latitude) / 2,
+            (min_longitude + max_longitude) / 2,
+            limit,
+        )
+
+    async def get_tile(self, zoom: int, x: int, y: int):
+        """Get the marker clusters of a map tile"""
+        if zoom > tiles.MAX_CLUSTER_ZOOM:
+            min_latitude, min_longitude, max_latitude, max_longitude = tiles.tile_bounds(zoom, x, y)
+            result = await self.db.execute(
+                select(models.PerevalAdded.id, models.Coords.latitude, models.Coords.longitude)
+                .join(models.Coords, models.PerevalAdded.coord_id == models.Coords.id)
+                .where(
+                    models.Coords.latitude.between(min_latitude, max_latitude),
+                    models.Coords.longitude.between(min_longitude, max_longitude),
+                    or_(*(
+                        and_(models.Coords.geohash >= prefix, models.Coords.geohash < prefix + geo.PREFIX_END)
+                        for prefix in geo.bbox_prefixes(min_latitude, min_longitude, max_latitude, max_longitude)
+                    )),
+                )
+            )
+            return [
+                {"count": 1, "latitude": row.latitude, "longitude": row.longitude, "pereval_id": row.id}
+                for row in result
+            ]
+
+        # Aggregates plus the deltas queued since the last fold, so markers are current right after a write
+        min_x, max_x, min_y, max_y = tiles.tile_cell_range(zoom, x, y)
+        cells = union_all(*(
+            select(model.cell_x, model.cell_y, model.count, model.sum_latitude, model.sum_longitude)
+            .where(
+                model.zoom == zoom,
+                model.cell_x.between(min_x, max_x),
+                model.cell_y.between(min_y, max_y),
+            )
+            for model in (models.TileCluster, models.TileClusterDelta)
+        )).subquery()
+        result = await self.db.execute(
+            select(
+                func.sum(cells.c.count).label("count"),
+                func.sum(cells.c.sum_latitude).label("sum_latitude"),
+                func.sum(cells.c.sum_longitude).label("sum_longitude"),
+            )
+            .group_by(cells.c.cell_x, cells.c.cell_y)
+            .having(func.sum(cells.c.count) > 0)
+        )
+        return tiles.cluster_markers(result)
+
+    async def _set_status(self, pereval_ids: List[int], status: str, claimed_by: Optional[str]):
+        """Move locked perevals to a status, giving each its own change sequence number, return their new versions"""
+        table = models.PerevalAdded.__table__
+        versions = dict((await self.db.execute(
+            update(table)
+            .where(table.c.id.in_(pereval_ids))
+            .values(status=status, claimed_by=claimed_by, version=table.c.version + 1)
+            .returning(table.c.id, table.c.version)
+        )).all())
+        await changes.stamp(self.db, pereval_ids, status)
+        return versions
+
+    async def claim_perevals(self, moderator: str, limit: int):
+        """Move up to limit of the oldest new perevals to pending for a moderator.
+
+        Rows locked by a concurrent claim are skipped, so moderators never get the same pass.
+        """
+        try:
+            pereval_ids = (await self.db.execute(
+                select(models.PerevalAdded.id)
+                .where(models.PerevalAdded.status == "new")
+                .order_by(models.PerevalAdded.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            if pereval_ids:
+                await self._set_status(pereval_ids, "pending", moderator)
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+        return await self.get_perevals_by_ids(pereval_ids)
+
+    async def transition_perevals(self, pereval_ids: List[int], status: str, moderator: str):
+        """Move the perevals a moderator has claimed to a status, return the new versions of those moved by id"""
+        if status not in MODERATION_TRANSITIONS:
+            raise ValueError(f"Unknown status: {status}")
+
+        query = (
+            select(models.PerevalAdded.id)
+            .where(
+                models.PerevalAdded.id.in_(pereval_ids),
+                models.PerevalAdded.status == MODERATION_TRANSITIONS[status],
+            )
+            .order_by(models.PerevalAdded.id)
+            .with_for_update()
+        )
+        if MODERATION_TRANSITIONS[status] == "pending":
+            query = query.where(models.PerevalAdded.claimed_by == moderator)
+        try:
+            moved_ids = (await self.db.execute(query)).scalars().all()
+            versions = {}
+            if moved_ids:
+                versions = await self._set_status(moved_ids, status, None if status == "new" else moderator)
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+        return {pereval_id: versions[pereval_id] for pereval_id in moved_ids}
+
+    async def _update_images(self, db_pereval: models.PerevalAdded, images: List[schemas.PerevalImageUpdate]):
+        """Make the images of a pereval match a list, return the references that were not stored before.
+
+        Images are matched by id, or else by reference since stored images are content addressed,
+        so an image that was sent again unchanged is neither updated nor re-inserted.
+        """
+        unmatched = {image.id: image for image in db_pereval.images}
+        by_reference = {}
+        for image in db_pereval.images:
+            by_reference.setdefault(image.img, []).append(image.id)
+
+        changed = []
+        inserted = []
+        new_references = []
+        for image_data in images:
+            if image_data.id is not None:
+                if image_data.id not in unmatched:
+                    raise ValueError(f"Image with ID {image_data.id} does not belong to pereval {db_pereval.id}")
+                current = unmatched.pop(image_data.id)
+            else:
+                candidates = [image_id for image_id in by_reference.get(image_data.img, []) if image_id in unmatched]
+                current = unmatched.pop(candidates[0]) if candidates else None
+
+            if current is None:
+                inserted.append({"pereval_id": db_pereval.id, "img_title": image_data.img_title, "img": image_data.img})
+            elif (current.img_title, current.img) != (image_data.img_title, image_data.img):
+                changed.append({"image_id": current.id, "img_title": image_data.img_title, "img": image_data.img})
+                if current.img != image_data.img:
+                    new_references.append(image_data.img)
+
+        table = models.PerevalImages.__table__
+        if unmatched:
+            await self.db.execute(delete(table).where(table.c.id.in_(list(unmatched))))
+        if changed:
+            await self.db.execute(
+                update(table)
+                .where(table.c.id == bindparam("image_id"))
+                .values(img_title=bindparam("img_title"), img=bindparam("img")),
+                changed,
+            )
+        if inserted:
+            await self.db.execute(insert(table), inserted)
+        return new_references + [image["img"] for image in inserted]
+
+    async def update_pereval(self, pereval_id: int, pereval_data: schemas.PerevalUpdate, precondition=None):
+        """Change the fields set in pereval_data in one transaction, with one UPDATE per table.
+
+        The pass row is locked first and the change sequence number is taken last, following the lock
+        order at the top of this module, so concurrent edits wait instead of overwriting each other;
+        precondition is called with the locked pass and raises PreconditionFailed when it returns False.
+        Returns the updated (id, version, updated_at, titles) row and the image references to make variants of,
+        or None if there is no such pass.
+        """
+        try:
+            db_pereval = (await self.db.execute(
+                select(models.PerevalAdded)
+                .options(joinedload(models.PerevalAdded.coords), selectinload(models.PerevalAdded.images))
+                .where(models.PerevalAdded.id == pereval_id)
+                .with_for_update(of=models.PerevalAdded)
+                .execution_options(populate_existing=True)
+            )).scalars().first()
+            if db_pereval is None:
+                return None
+            if db_pereval.status != "new":
+                raise PerevalNotEditable()
+            if precondition is not None and not precondition(db_pereval):
+                raise PreconditionFailed()
+
+            if "coords" in pereval_data.model_fields_set:
+                coords = db_pereval.coords
+                old_point = (coords.latitude, coords.longitude)
+                new_point = (pereval_data.coords.latitude, pereval_data.coords.longitude)
+                await self.db.execute(
+                    update(models.Coords.__table__)
+                    .where(models.Coords.__table__.c.id == coords.id)
+                    .values(coords_values(pereval_data.coords))
+                )
+                if new_point != old_point:
+                    await tiles.queue_deltas(self.db, tiles.merge_deltas(
+                        tiles.cluster_deltas([old_point], sign=-1),
+                        tiles.cluster_deltas([new_point]),
+                    ))
+
+            new_images = []
+            if "images" in pereval_data.model_fields_set:
+                new_images = await self._update_images(db_pereval, pereval_data.images)
+
+            fields = pereval_data.model_dump(exclude_unset=True, exclude={"coords", "images"})
+            table = models.PerevalAdded.__table__
+            # The version check is redundant under the row lock, but still guards databases without FOR UPDATE
+            updated = (await self.db.execute(
+                update(table)
+                .where(table.c.id == pereval_id, table.c.version == db_pereval.version)
+                .values(**fields, version=table.c.version + 1)
+                .returning(table.c.id, table.c.version, table.c.updated_at,
+                           table.c.title, table.c.beauty_title, table.c.other_titles)
+            )).first()
+            if updated is None:
+                raise PreconditionFailed()
+
+            await changes.stamp(self.db, [pereval_id])
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+        return updated, new_images
+
+    async def submit_pereval(self, pereval_data: schemas.PerevalAddedCreate, idempotency_key: Optional[str] = None):
+        """Create a pereval with its user, coords and images in one transaction.
+
+        With an idempotency_key claimed by idempotency.begin, the response for retries is stored in the
+        same transaction, so the key can never stay in progress for a pass that was created.
+        """
+        return (await self.submit_perevals([pereval_data], idempotency_key))[0]
+
+    async def submit_perevals(
+        self, perevals_data: List[schemas.PerevalAddedCreate], idempotency_key: Optional[str] = None,
+    ):
+        """Create perevals with their users, coords and images in one transaction using bulk inserts"""
+        if not perevals_data:
+            return []
+
+        try:
+            emails = list(dict.fromkeys(pereval_data.user.email for pereval_data in perevals_data))
+            user_ids = dict((await self.db.execute(
+                select(models.User.email, models.User.id).where(models.User.email.in_(emails))
+            )).all())
+
+            new_users = {}
+            for pereval_data in perevals_data:
+                if pereval_data.user.email not in user_ids:
+                    new_users.setdefault(pereval_data.user.email, pereval_data.user.model_dump())
+            if new_users:
+                user_ids.update((await self.db.execute(
+                    insert(models.User).returning(models.User.email, models.User.id),
+                    list(new_users.values()),
+                )).all())
+
+            coords_ids = (await self.db.execute(
+                insert(models.Coords).returning(models.Coords.id, sort_by_parameter_order=True),
+                [coords_values(pereval_data.coords) for pereval_data in perevals_data],
+            )).scalars().all()
+            await tiles.queue_deltas(self.db, tiles.cluster_deltas(
+                (pereval_data.coords.latitude, pereval_data.coords.longitude) for pereval_data in perevals_data
+            ))
+
+            pereval_ids = (await self.db.execute(
+                insert(models.PerevalAdded).returning(models.PerevalAdded.id, sort_by_parameter_order=True),
+                [
+                    pereval_data.model_dump(exclude={"user", "coords", "images"})
+                    | {"user_id": user_ids[pereval_data.user.email], "coord_id": coords_id, "status": "new"}
+                    for pereval_data, coords_id in zip(perevals_data, coords_ids)
+                ],
+            )).scalars().all()
+
+            images = [
+                {"pereval_id": pereval_id, "img_title": image.img_title, "img": image.img}
+                for pereval_data, pereval_id in zip(perevals_data, pereval_ids)
+                for image in pereval_data.images
+            ]
+            if images:
+                await self.db.execute(insert(models.PerevalImages), images)
+
+            if idempotency_key is not None:
+                await idempotency.complete(self.db, idempotency_key, 200, json.dumps(submit_result(pereval_ids[0])))
+
+            await changes.stamp(self.db, pereval_ids, "new")
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+
+        return list(pereval_ids)
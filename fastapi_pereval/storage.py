@@ -0,0 +1,161 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import BinaryIO, Iterator
+
+STORAGE_PATH = os.getenv("FSTR_STORAGE_PATH", "media")
+CHUNK_SIZE = 64 * 1024
+
+_REFERENCE_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobStorage(ABC):
+    """Interface of a content-addressed blob store, keys are sha256 hex digests"""
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        ...
+
+    @abstractmethod
+    def put_file(self, fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+        ...
+
+    @abstractmethod
+    def put_variant(self, key: str, variant: str, data: bytes) -> str:
+        ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+
+class LocalBlobStorage(BlobStorage):
+    """Blob store keeping each blob in a file named after its sha256 digest"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data: bytes) -> str:
+        """Store data and return its key, identical data is stored only once"""
+        return self.put_file(io.BytesIO(data))
+
+    def put_file(self, fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+        """Copy a file into the store chunk by chunk and return its key"""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                while chunk := fileobj.read(chunk_size):
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+            key = digest.hexdigest()
+            os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return key
+
+    def put_variant(self, key: str, variant: str, data: bytes) -> str:
+        """Store a derived version of a blob next to it and return the variant key"""
+        name = variant_key(key, variant)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path(key)))
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, self.path(name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return name
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the blob contents in chunks of at most chunk_size bytes"""
+        try:
+            blob_file = open(self.path(key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        with blob_file:
+            while chunk := blob_file.read(chunk_size):
+                yield chunk
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+@lru_cache
+def get_storage() -> BlobStorage:
+    """Get the blob store configured for the application"""
+    return LocalBlobStorage(STORAGE_PATH)
+
+
+def variant_key(key: str, variant: str) -> str:
+    """Get the key of a derived version of a blob, e.g. a thumbnail"""
+    return f"{key}.{variant}"
+
+
+def is_reference(value: str) -> bool:
+    """Check whether an img value is a blob reference rather than inline data"""
+    return bool(_REFERENCE_RE.match(value))
+
+
+def decode_inline_image(img: str) -> bytes:
+    """Decode a base64 (optionally data URL) image, other strings are kept as raw bytes"""
+    if img.startswith("data:") and "," in img:
+        img = img.split(",", 1)[1]
+    try:
+        return base64.b64decode(img, validate=True)
+    except (binascii.Error, ValueError):
+        return img.encode()
+
+
+def store_inline_image(storage: BlobStorage, img: str) -> str:
+    """Move an inline image into the blob store and return its reference"""
+    if is_reference(img) and storage.exists(img):
+        return img
+    return storage.put(decode_inline_image(img))
+
+
+def guess_content_type(first_chunk: bytes) -> str:
+    """Guess the image content type from its leading bytes"""
+    for signature, content_type in _SIGNATURES:
+        if first_chunk.startswith(signature):
+            return content_type
+    if first_chunk[:4] == b"RIFF" and first_chunk[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
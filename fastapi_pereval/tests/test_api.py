@@ -1,38 +1,72 @@
-from fastapi.testclient import TestClient
+import httpx
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import pytest_asyncio
+from sqlalchemy import event, func, select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
 from faker import Faker
-from fastapi_pereval.main import app 
-from fastapi_pereval import schemas, models, services
+import base64
+import csv
+import io
+import json
+from PIL import Image
+from fastapi_pereval.main import (
+    app, get_db, get_image_processor, get_reference_data, get_response_cache, get_search_index, get_session_factory,
+    get_storage,
+)
+from fastapi_pereval import main, schemas, models, services, storage, imaging, search, cache, reference, idempotency, instrumentation, serialization, compression, tiles
 from datetime import datetime
+from typing import List
+from pydantic import TypeAdapter
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"  
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+@pytest_asyncio.fixture(scope="function")
+async def db():
+    engine = create_async_engine(SQLALCHEMY_DATABASE_URL, poolclass=StaticPool)
+    instrumentation.instrument_engine(engine)
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
 
-models.Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
 
-@pytest.fixture(scope="function")
-def db():
-    db = SessionLocal()
+    async def override_get_db():
+        async with SessionLocal() as session:
+            yield session
 
-    models.Base.metadata.drop_all(bind=engine)
-    models.Base.metadata.create_all(bind=engine)
-    yield db
-    db.close()
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: SessionLocal
+    search_index = search.SearchIndex()
+    app.dependency_overrides[get_search_index] = lambda: search_index
+    response_cache = cache.TTLCache(max_size=16, ttl=60)
+    app.dependency_overrides[get_response_cache] = lambda: response_cache
+    reference_data = reference.ReferenceData(ttl=60)
+    app.dependency_overrides[get_reference_data] = lambda: reference_data
+
+    async with SessionLocal() as db:
+        yield db
+
+    app.dependency_overrides.clear()
+    await engine.dispose()
 
 @pytest.fixture
 def db_service(db):
     return services.DatabaseService(db)
 
 @pytest.fixture
-def client():
-    return TestClient(app)
+def blob_storage(tmp_path):
+    blob_storage = storage.LocalBlobStorage(str(tmp_path / "media"))
+    app.dependency_overrides[get_storage] = lambda: blob_storage
+    app.dependency_overrides[get_image_processor] = lambda: imaging.ImageProcessor(workers=0)
+    return blob_storage
 
-@pytest.fixture
-def user_and_coords(db_service):  
+@pytest_asyncio.fixture
+async def client(db, blob_storage):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+@pytest_asyncio.fixture
+async def user_and_coords(db_service):
     fake = Faker()
     user_data = schemas.UserCreate(
         email=fake.email(),
@@ -42,8 +76,9 @@ def user_and_coords(db_service):
     )
     coords_data = schemas.CoordsCreate(latitude=40.7128, longitude=74.0060, height=5000)
 
-    user = db_service.create_user(user_data)
-    coords = db_service.create_coords(coords_data)
+    user = await db_service.create_user(user_data)
+    coords = await db_service.create_coords(coords_data)
+    await db_service.db.commit()
     
     return user, coords
 
@@ -65,53 +100,114 @@ def pereval_data(user_and_coords):
     )
 
 
-def test_submit_data(client, pereval_data):
+@pytest.mark.asyncio
+async def test_submit_data(client, pereval_data):
     data = pereval_data.dict()
     data["add_time"] = data["add_time"].isoformat()  
-    response = client.post("/submitData", json=data)
+    response = await client.post("/submitData", json=data)
 
     assert response.status_code == 200
     assert response.json()["status"] == 200
     assert "id" in response.json()
 
 
-def test_get_pereval_by_id(client, pereval_data):
+@pytest.mark.asyncio
+async def test_get_pereval_by_id(client, pereval_data):
     data = pereval_data.dict()
     data["add_time"] = data["add_time"].isoformat()  
-    response = client.post("/submitData", json=data)
+    response = await client.post("/submitData", json=data)
     pereval_id = response.json()["id"]
     
-    response = client.get(f"/submitData/{pereval_id}")
+    response = await client.get(f"/submitData/{pereval_id}")
     
     assert response.status_code == 200
     assert response.json()["title"] == pereval_data.title
     assert response.json()["beauty_title"] == pereval_data.beauty_title
 
 
-def test_update_pereval(client, pereval_data):
+@pytest.mark.asyncio
+async def test_update_pereval(client, pereval_data):
     data = pereval_data.dict()
     data["add_time"] = data["add_time"].isoformat()  
-    response = client.post("/submitData", json=data)
+    response = await client.post("/submitData", json=data)
     pereval_id = response.json()["id"]
 
     updated_data = pereval_data.dict()
     updated_data["title"] = "Новый Пик Эверест"
     updated_data["add_time"] = updated_data["add_time"].isoformat()  
 
-    response = client.patch(f"/submitData/{pereval_id}", json=updated_data)
+    response = await client.patch(f"/submitData/{pereval_id}", json=updated_data)
 
     assert response.status_code == 200
     assert response.json()["state"] == 1
     assert response.json()["message"] == "Pereval successfully updated"
 
 
-def test_get_pereval_by_email(client, user_and_coords, pereval_data):
+@pytest.mark.asyncio
+async def test_partial_update_pereval(client, db, pereval_data):
+    data = pereval_data.model_dump(mode="json")
+    data["images"] = [{"img_title": "Седловина", "img": "image_1"}, {"img_title": "Подъём", "img": "image_2"}]
+    pereval_id = (await client.post("/submitData", json=data)).json()["id"]
+    images = (await client.get(f"/submitData/{pereval_id}")).json()["images"]
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sync_engine = db.bind.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = await client.patch(f"/submitData/{pereval_id}", json={"title": "Пик Ленина", "other_titles": None})
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count_statement)
+
+    assert response.json()["state"] == 1
+    assert response.headers["etag"] == f'"{pereval_id}-2"'
+    writes = [statement for statement in statements if statement.split()[0] in ("INSERT", "UPDATE", "DELETE")]
+    assert [statement for statement in writes if "pereval_images" in statement or "coords" in statement] == []
+    pereval_updates = [statement for statement in writes if statement.startswith("UPDATE pereval_added")]
+    assert len(pereval_updates) == 2
+    # The change sequence number is stamped last, so the counter row is locked only until the commit
+    assert writes[-1] == pereval_updates[-1]
+    assert "change_seq" in writes[-1] and "title" not in writes[-1]
+
+    pereval = (await client.get(f"/submitData/{pereval_id}")).json()
+    assert pereval["title"] == "Пик Ленина"
+    assert pereval["other_titles"] is None
+    assert pereval["beauty_title"] == data["beauty_title"]
+    assert pereval["images"] == images
+
+    response = await client.patch(f"/submitData/{pereval_id}", json={"images": [
+        {"id": images[0]["id"], "img_title": "Перевальная точка", "img": images[0]["img"]},
+        {"img_title": "Подъём", "img": images[1]["img"]},
+        {"img_title": "Спуск", "img": "image_3"},
+    ]})
+    assert response.json()["state"] == 1
+    updated_images = (await client.get(f"/submitData/{pereval_id}")).json()["images"]
+    assert [image["id"] for image in updated_images[:2]] == [images[0]["id"], images[1]["id"]]
+    assert [image["img_title"] for image in updated_images] == ["Перевальная точка", "Подъём", "Спуск"]
+
+    response = await client.patch(f"/submitData/{pereval_id}", json={"images": [{"id": 999, "img": "image_4"}]})
+    assert response.json()["state"] == 0
+    assert (await client.get(f"/submitData/{pereval_id}")).headers["etag"] == f'"{pereval_id}-3"'
+
+    response = await client.patch(f"/submitData/{pereval_id}", json={"images": [updated_images[2]]})
+    updated_images = (await client.get(f"/submitData/{pereval_id}")).json()["images"]
+    assert [image["img_title"] for image in updated_images] == ["Спуск"]
+
+    response = await client.patch(f"/submitData/{pereval_id}", json={"title": None})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_get_pereval_by_email(client, user_and_coords, pereval_data):
     user, coords = user_and_coords
     data = pereval_data.dict()
     data["add_time"] = data["add_time"].isoformat()  
-    response = client.post("/submitData", json=data)
+    response = await client.post("/submitData", json=data)
     
-    response = client.get(f"/submitData/?user_email={user.email}")
+    response = await client.get(f"/submitData/?user_email={user.email}")
 
     response_data = response.json()
     print(response_data)
@@ -119,3 +215,735 @@ def test_get_pereval_by_email(client, user_and_coords, pereval_data):
     assert response.status_code == 200
     assert len(response.json()) > 0
     assert response_data[0]["user"]["email"] == user.email
+
+
+@pytest.mark.asyncio
+async def test_get_pereval_is_cached_until_update(client, pereval_data):
+    data = pereval_data.model_dump(mode="json")
+    response = await client.post("/submitData", json=data)
+    pereval_id = response.json()["id"]
+
+    hits = cache.cache_hits.value()
+    first = await client.get(f"/submitData/{pereval_id}")
+    second = await client.get(f"/submitData/{pereval_id}")
+    assert second.content == first.content
+    assert cache.cache_hits.value() == hits + 1
+
+    data["title"] = "Новый Пик Эверест"
+    await client.patch(f"/submitData/{pereval_id}", json=data)
+    response = await client.get(f"/submitData/{pereval_id}")
+    assert response.json()["title"] == "Новый Пик Эверест"
+
+    response = await client.get("/submitData/999")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_and_if_match(client, pereval_data):
+    data = pereval_data.model_dump(mode="json")
+    response = await client.post("/submitData", json=data)
+    pereval_id = response.json()["id"]
+
+    response = await client.get(f"/submitData/{pereval_id}")
+    etag = response.headers["etag"]
+    assert etag == f'"{pereval_id}-1"'
+
+    response = await client.get(f"/submitData/{pereval_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    last_modified = response.headers["last-modified"]
+    response = await client.get(f"/submitData/{pereval_id}", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+    data["title"] = "Новый Пик Эверест"
+    response = await client.patch(f"/submitData/{pereval_id}", json=data, headers={"If-Match": etag})
+    assert response.status_code == 200
+    new_etag = response.headers["etag"]
+    assert new_etag == f'"{pereval_id}-2"'
+
+    response = await client.patch(f"/submitData/{pereval_id}", json=data, headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert response.json()["state"] == 0
+
+    response = await client.get(f"/submitData/{pereval_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] == new_etag
+
+
+def test_ttl_cache_evicts_expired_and_least_recently_used():
+    def response(body, version=1):
+        return cache.CachedResponse(body=body, etag=f'"1-{version}"', last_modified="", version=version)
+
+    response_cache = cache.TTLCache(max_size=2, ttl=60)
+    response_cache.set("a", response(b"1"))
+    response_cache.set("b", response(b"2"))
+    response_cache.get("a")
+    response_cache.set("c", response(b"3"))
+
+    assert response_cache.get("b") is None
+    assert response_cache.get("a").body == b"1"
+
+    # A reader that loaded version 1 before an update to version 2 must not cache it afterwards
+    response_cache.delete("a", 2)
+    response_cache.set("a", response(b"old", 1))
+    assert response_cache.get("a") is None
+    response_cache.set("a", response(b"new", 2))
+    response_cache.set("a", response(b"old", 1))
+    assert response_cache.get("a").body == b"new"
+    response_cache.delete("a", 2)
+    assert response_cache.get("a").body == b"new"
+
+    response_cache.ttl = -1
+    response_cache.set("c", response(b"3"))
+    assert response_cache.get("c") is None
+
+
+def test_incomplete_cache_backend_cannot_be_created():
+    class WriteOnlyCache(cache.CacheBackend):
+        def set(self, key, value):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnlyCache()
+
+
+@pytest.mark.asyncio
+async def test_get_pereval_by_email_query_count(client, db, user_and_coords, pereval_data):
+    user, coords = user_and_coords
+    data = pereval_data.model_dump(mode="json")
+    data["images"] = [{"img_title": "Седловина", "img": "image_1"}, {"img_title": "Подъём", "img": "image_2"}]
+    for _ in range(5):
+        await client.post("/submitData", json=data)
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sync_engine = db.bind.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", count_statement)
+    try:
+        list_response = await client.get(f"/submitData/?user_email={user.email}")
+        list_queries = len(statements)
+        statements.clear()
+        pereval_response = await client.get(f"/submitData/{list_response.json()[0]['id']}")
+        pereval_queries = len(statements)
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count_statement)
+
+    assert len(list_response.json()) == 5
+    assert len(pereval_response.json()["images"]) == 2
+    assert list_queries <= 2
+    assert pereval_queries <= 2
+
+
+@pytest.mark.asyncio
+async def test_images_are_moved_to_blob_storage(client, blob_storage, pereval_data):
+    image_bytes = b"\x89PNG\r\n\x1a\n" + b"\x00" * 1024
+    data = pereval_data.model_dump(mode="json")
+    data["images"] = [{"img_title": "Седловина", "img": base64.b64encode(image_bytes).decode()}]
+    response = await client.post("/submitData", json=data)
+
+    response = await client.get(f"/submitData/{response.json()['id']}")
+    image = response.json()["images"][0]
+    assert storage.is_reference(image["img"])
+    assert blob_storage.exists(image["img"])
+
+    response = await client.get(f"/images/{image['id']}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.content == image_bytes
+
+    response = await client.get("/images/999")
+    assert response.status_code == 404
+
+
+def test_incomplete_blob_storage_cannot_be_created():
+    class ReadOnlyStorage(storage.BlobStorage):
+        def exists(self, key):
+            return False
+
+    with pytest.raises(TypeError):
+        ReadOnlyStorage()
+
+
+@pytest.mark.asyncio
+async def test_submit_data_multipart(client, blob_storage, pereval_data):
+    image_bytes = b"\xff\xd8\xff" + b"\x01" * 200_000
+    response = await client.post(
+        "/submitData/multipart",
+        data={"data": pereval_data.model_dump_json(), "img_titles": ["Седловина"]},
+        files=[("images", ("saddle.jpg", image_bytes, "image/jpeg")), ("images", ("ascent.jpg", b"\xff\xd8\xff", "image/jpeg"))],
+    )
+    assert response.json()["status"] == 200
+
+    response = await client.get(f"/submitData/{response.json()['id']}")
+    images = response.json()["images"]
+    assert [image["img_title"] for image in images] == ["Седловина", "ascent.jpg"]
+    assert b"".join(blob_storage.iter_chunks(images[0]["img"])) == image_bytes
+
+    response = await client.post("/submitData/multipart", data={"data": "{}"})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_submit_data_multipart_limits(client, blob_storage, pereval_data, monkeypatch):
+    monkeypatch.setattr(main, "MULTIPART_MAX_FILES", 2)
+    monkeypatch.setattr(main, "MULTIPART_MAX_FILE_BYTES", 1000)
+    data = {"data": pereval_data.model_dump_json()}
+
+    response = await client.post("/submitData/multipart", data=data, files=[("images", ("big.jpg", b"\x01" * 1001, "image/jpeg"))])
+    assert response.status_code == 413
+    assert response.json()["id"] is None
+
+    files = [("images", (f"{index}.jpg", b"\x01" * 10, "image/jpeg")) for index in range(3)]
+    response = await client.post("/submitData/multipart", data=data, files=files)
+    assert response.status_code == 413
+
+    response = await client.post(
+        "/submitData/multipart",
+        files=[("data", ("pass.json", data["data"].encode(), "application/json"))] + files[:2],
+    )
+    assert response.json()["status"] == 200
+
+    response = await client.post("/submitData/multipart", content=b"{}", headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_image_variant(client, pereval_data):
+    buffer = io.BytesIO()
+    Image.new("RGB", (2000, 1000), "blue").save(buffer, format="PNG")
+    data = pereval_data.model_dump(mode="json")
+    data["images"] = [{"img_title": "Седловина", "img": base64.b64encode(buffer.getvalue()).decode()}]
+    response = await client.post("/submitData", json=data)
+    response = await client.get(f"/submitData/{response.json()['id']}")
+    image_id = response.json()["images"][0]["id"]
+
+    response = await client.get(f"/images/{image_id}", params={"size": "thumb"})
+    assert response.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(response.content)).size == (128, 64)
+
+    response = await client.get(f"/images/{image_id}")
+    assert response.headers["content-type"] == "image/png"
+
+    response = await client.get(f"/images/{image_id}", params={"size": "huge"})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_submit_data_bulk(client, user_and_coords, pereval_data):
+    user, coords = user_and_coords
+    item = pereval_data.model_dump(mode="json")
+    other_user = dict(item["user"], email="other@example.com")
+    items = [item, dict(item, user=other_user), {"title": "broken"}, dict(item, user=other_user, title="Второй")]
+
+    response = await client.post("/submitData/bulk", json=items)
+    results = response.json()["results"]
+
+    assert response.status_code == 200
+    assert [result["id"] is not None for result in results] == [True, True, False, True]
+    assert results[2]["error"]
+
+    response = await client.get("/submitData/", params={"user_email": "other@example.com"})
+    assert [pereval["title"] for pereval in response.json()] == ["Пик Эверест", "Второй"]
+    assert response.json()[0]["user"]["id"] == response.json()[1]["user"]["id"]
+
+
+@pytest.mark.asyncio
+async def test_submit_data_bulk_ndjson(client, pereval_data):
+    body = "\n".join(pereval_data.model_dump_json() for _ in range(3)) + "\n"
+
+    response = await client.post("/submitData/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert len({result["id"] for result in response.json()["results"]}) == 3
+
+
+@pytest.mark.asyncio
+async def test_export(client, user_and_coords, pereval_data):
+    user, coords = user_and_coords
+    data = pereval_data.model_dump(mode="json")
+    data["images"] = [{"img_title": "Седловина", "img": "image_1"}]
+    for _ in range(3):
+        await client.post("/submitData", json=data)
+
+    response = await client.get("/export", params={"format": "ndjson"})
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(rows) == 3
+    assert rows[0]["user_email"] == user.email
+    assert rows[0]["latitude"] == coords.latitude
+    assert storage.is_reference(rows[0]["images"][0]["img"])
+
+    response = await client.get("/export", params={"format": "csv"})
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 3
+    assert rows[2]["title"] == pereval_data.title
+
+
+@pytest.mark.asyncio
+async def test_metrics(client):
+    response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert "# TYPE db_pool_wait_seconds histogram" in response.text
+    assert "db_pool_checked_out 0" in response.text
+
+
+@pytest.mark.asyncio
+async def test_request_instrumentation(client, pereval_data, monkeypatch, caplog):
+    await client.post("/submitData", json=pereval_data.model_dump(mode="json"))
+    route = {"method": "GET", "route": "/submitData/"}
+    requests = instrumentation.request_queries.count(**route)
+
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_SECONDS", 0)
+    with caplog.at_level("WARNING", logger="fastapi_pereval.instrumentation"):
+        response = await client.get("/submitData/", params={"user_email": pereval_data.user.email})
+
+    assert response.status_code == 200
+    assert response.headers["server-timing"].startswith('db;dur=')
+    assert '"2 queries"' in response.headers["server-timing"]
+    assert instrumentation.request_queries.count(**route) == requests + 1
+    assert any("Slow query" in record.message and "FROM pereval_added" in record.message for record in caplog.records)
+
+    metrics_text = (await client.get("/metrics")).text
+    assert 'http_request_queries_count{method="GET",route="/submitData/"}' in metrics_text
+    assert 'http_request_serialization_seconds_count{method="GET",route="/submitData/"}' in metrics_text
+
+
+@pytest.mark.asyncio
+async def test_fast_serialization_matches_pydantic(client, db_service, user_and_coords, pereval_data):
+    user, coords = user_and_coords
+    data = pereval_data.model_dump(mode="json")
+    data["images"] = [{"img_title": "Седловина", "img": "image_1"}, {"img_title": None, "img": "image_2"}]
+    await client.post("/submitData", json=data)
+    data.update(beauty_title=None, connect=None, add_time="2025-02-15T10:20:30.123456", images=[])
+    data["coords"]["latitude"] = 43.35045
+    await client.post("/submitData", json=data)
+
+    perevals = await db_service.get_pereval_by_email(user.email)
+    expected = TypeAdapter(List[schemas.PerevalAddedResponse]).dump_json(
+        [schemas.PerevalAddedResponse.model_validate(pereval) for pereval in perevals]
+    )
+    assert serialization.dumps_many(schemas.PerevalAddedResponse, perevals) == expected
+
+    response = await client.get("/submitData/", params={"user_email": user.email})
+    assert response.content == expected
+
+    perevals, status_changes, cursor, has_more = await db_service.get_changes(user.email, 0, 10)
+    value = {"cursor": cursor, "has_more": has_more, "perevals": perevals, "status_changes": status_changes}
+    response = await client.get("/sync", params={"user_email": user.email})
+    assert response.content == schemas.SyncResponse.model_validate(value).model_dump_json().encode()
+
+
+@pytest.mark.asyncio
+async def test_summary_view_and_compression(client, user_and_coords, pereval_data):
+    user, coords = user_and_coords
+    data = pereval_data.model_dump(mode="json")
+    data["images"] = [{"img_title": "Седловина", "img": "image_1"}, {"img_title": "Подъём", "img": "image_2"}]
+    for _ in range(10):
+        await client.post("/submitData", json=data)
+
+    params = {"user_email": user.email, "view": "summary", "limit": 4}
+    response = await client.get("/submitData/", params=params, headers={"Accept-Encoding": "identity"})
+    summaries = response.json()
+    assert "content-encoding" not in response.headers
+    assert len(summaries) == 4
+    assert set(summaries[0]) == set(schemas.PerevalSummaryResponse.model_fields)
+    assert summaries[0]["image_count"] == 2
+    assert summaries[0]["latitude"] == coords.latitude
+
+    response = await client.get(
+        "/submitData/", params=params | {"cursor": response.headers["x-next-cursor"]},
+        headers={"Accept-Encoding": "identity"},
+    )
+    assert [summary["id"] for summary in response.json()] == [summary["id"] + 4 for summary in summaries]
+
+    full = await client.get("/submitData/", params={"user_email": user.email}, headers={"Accept-Encoding": "gzip"})
+    assert full.headers["content-encoding"] == "gzip"
+    assert full.headers["vary"] == "Accept-Encoding"
+    assert int(full.headers["content-length"]) < len(full.content)
+    assert len(full.json()) == 10
+
+    response = await client.get("/submitData/", params={"user_email": user.email}, headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.content == full.content
+
+    response = await client.get("/export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.text.splitlines()) == 10
+
+    response = await client.get("/metrics", headers={"Accept-Encoding": "gzip;q=0, br;q=0"})
+    assert "content-encoding" not in response.headers
+
+    schema = (await client.get("/openapi.json")).json()
+    list_schema = schema["paths"]["/submitData/"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert sorted(option["items"]["$ref"].rsplit("/", 1)[1] for option in list_schema["anyOf"]) == [
+        "PerevalAddedResponse", "PerevalSummaryResponse",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_compressed_responses_have_their_own_etag(client, pereval_data):
+    data = pereval_data.model_dump(mode="json") | {"connect": "Седловина " * 200}
+    pereval_id = (await client.post("/submitData", json=data)).json()["id"]
+
+    plain = await client.get(f"/submitData/{pereval_id}", headers={"Accept-Encoding": "identity"})
+    compressed = await client.get(f"/submitData/{pereval_id}", headers={"Accept-Encoding": "br"})
+    assert plain.headers["etag"] == f'"{pereval_id}-1"'
+    assert compressed.headers["content-encoding"] == "br"
+    assert compressed.headers["etag"] == f'"{pereval_id}-1-br"'
+
+    response = await client.get(
+        f"/submitData/{pereval_id}", headers={"Accept-Encoding": "br", "If-None-Match": compressed.headers["etag"]},
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == compressed.headers["etag"]
+
+    response = await client.patch(
+        f"/submitData/{pereval_id}", json={"title": "Новый"}, headers={"If-Match": compressed.headers["etag"]},
+    )
+    assert response.json()["state"] == 1
+
+
+def test_strip_etag_encodings():
+    assert compression.strip_etag_encodings('"7-2-br", "7-3-gzip", W/"7-4"') == ('"7-2", "7-3", W/"7-4"', "gzip")
+    assert compression.strip_etag_encodings('"7-2"') == ('"7-2"', None)
+    assert compression.encoded_etag('"7-2"', "br") == '"7-2-br"'
+
+
+def test_negotiate_encoding():
+    assert compression.negotiate("gzip, deflate, br") == "br"
+    assert compression.negotiate("gzip;q=1.0, br;q=0.5") == "gzip"
+    assert compression.negotiate("*") == "br"
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("") is None
+
+
+@pytest.mark.asyncio
+async def test_sync(client, user_and_coords, pereval_data):
+    user, coords = user_and_coords
+    data = pereval_data.model_dump(mode="json")
+    first_id = (await client.post("/submitData", json=data)).json()["id"]
+    second_id = (await client.post("/submitData", json=data)).json()["id"]
+
+    response = await client.get("/sync", params={"user_email": user.email, "limit": 1})
+    assert response.status_code == 200
+    page = response.json()
+    assert page["has_more"] is True
+    assert [pereval["id"] for pereval in page["perevals"]] == [first_id]
+    assert [(change["pereval_id"], change["status"]) for change in page["status_changes"]] == [(first_id, "new")]
+
+    page = (await client.get("/sync", params={"user_email": user.email, "since": page["cursor"]})).json()
+    assert page["has_more"] is False
+    assert [pereval["id"] for pereval in page["perevals"]] == [second_id]
+    cursor = page["cursor"]
+
+    page = (await client.get("/sync", params={"user_email": user.email, "since": cursor})).json()
+    assert page == {"cursor": cursor, "has_more": False, "perevals": [], "status_changes": []}
+
+    data["title"] = "Новый Пик Эверест"
+    await client.patch(f"/submitData/{first_id}", json=data)
+    page = (await client.get("/sync", params={"user_email": user.email, "since": cursor})).json()
+    assert [pereval["title"] for pereval in page["perevals"]] == ["Новый Пик Эверест"]
+    assert page["status_changes"] == []
+    assert page["cursor"] > cursor
+
+
+@pytest.mark.asyncio
+async def test_moderation(client, user_and_coords, pereval_data):
+    user, coords = user_and_coords
+    data = pereval_data.model_dump(mode="json")
+    ids = [(await client.post("/submitData", json=data)).json()["id"] for _ in range(3)]
+    etag = (await client.get(f"/submitData/{ids[0]}")).headers["etag"]
+
+    response = await client.post("/moderation/claim", json={"moderator": "anna", "limit": 2})
+    assert response.status_code == 200
+    assert [(pereval["id"], pereval["status"]) for pereval in response.json()] == [(ids[0], "pending"), (ids[1], "pending")]
+
+    response = await client.post("/moderation/claim", json={"moderator": "boris", "limit": 2})
+    assert [pereval["id"] for pereval in response.json()] == [ids[2]]
+
+    response = await client.get(f"/submitData/{ids[0]}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["status"] == "pending"
+
+    response = await client.post("/moderation/transitions", json={
+        "moderator": "anna", "ids": [ids[0], ids[2]], "status": "accepted",
+    })
+    assert response.json()["ids"] == [ids[0]]
+
+    response = await client.post("/moderation/transitions", json={
+        "moderator": "anna", "ids": [ids[1]], "status": "new",
+    })
+    assert response.json()["ids"] == [ids[1]]
+
+    statuses = [(await client.get(f"/submitData/{pereval_id}")).json()["status"] for pereval_id in ids]
+    assert statuses == ["accepted", "new", "pending"]
+
+    page = (await client.get("/sync", params={"user_email": user.email})).json()
+    assert [(change["pereval_id"], change["status"]) for change in page["status_changes"]][3:] == [
+        (ids[0], "pending"), (ids[1], "pending"), (ids[2], "pending"), (ids[0], "accepted"), (ids[1], "new"),
+    ]
+
+    response = await client.post("/moderation/transitions", json={"moderator": "anna", "ids": ids, "status": "done"})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_area_tree(client, pereval_data):
+    caucasus = (await client.post("/areas", json={"title": "Кавказ"})).json()
+    elbrus = (await client.post("/areas", json={"title": "Приэльбрусье", "id_parent": caucasus["id"]})).json()
+    baksan = (await client.post("/areas", json={"title": "Баксан", "id_parent": elbrus["id"]})).json()
+    alps = (await client.post("/areas", json={"title": "Альпы"})).json()
+    assert baksan["path"] == f"{caucasus['id']}/{elbrus['id']}/{baksan['id']}/"
+
+    response = await client.post("/areas", json={"title": "Нигде", "id_parent": 999})
+    assert response.status_code == 400
+
+    roots = (await client.get("/areas")).json()
+    assert [area["title"] for area in roots] == ["Альпы", "Кавказ"]
+    children = (await client.get("/areas", params={"parent_id": caucasus["id"]})).json()
+    assert [area["id"] for area in children] == [elbrus["id"]]
+
+    data = pereval_data.model_dump(mode="json")
+    baksan_ids = [(await client.post("/submitData", json=data | {"area_id": baksan["id"]})).json()["id"] for _ in range(2)]
+    alps_id = (await client.post("/submitData", json=data | {"area_id": alps["id"]})).json()["id"]
+
+    response = await client.get(f"/areas/{caucasus['id']}/perevals", params={"limit": 1})
+    assert [pereval["id"] for pereval in response.json()] == baksan_ids[:1]
+    assert response.json()[0]["area_id"] == baksan["id"]
+    cursor = response.headers["x-next-cursor"]
+    response = await client.get(f"/areas/{caucasus['id']}/perevals", params={"limit": 1, "after_id": cursor})
+    assert [pereval["id"] for pereval in response.json()] == baksan_ids[1:]
+    assert "x-next-cursor" not in response.headers
+
+    response = await client.patch(f"/areas/{elbrus['id']}", json={"id_parent": alps["id"]})
+    assert response.json()["path"] == f"{alps['id']}/{elbrus['id']}/"
+    assert (await client.get(f"/areas/{baksan['id']}")).json()["path"] == f"{alps['id']}/{elbrus['id']}/{baksan['id']}/"
+    assert (await client.get(f"/areas/{caucasus['id']}/perevals")).json() == []
+    response = await client.get(f"/areas/{alps['id']}/perevals")
+    assert [pereval["id"] for pereval in response.json()] == baksan_ids + [alps_id]
+
+    response = await client.patch(f"/areas/{alps['id']}", json={"id_parent": baksan["id"]})
+    assert response.status_code == 400
+    assert (await client.get("/areas/999/perevals")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_reference_data(client, db, pereval_data):
+    db.add_all([models.SprActivitiesTypes(id=1, title="пешком"), models.SprActivitiesTypes(id=2, title="лыжи")])
+    await db.commit()
+
+    response = await client.get("/reference/activities")
+    assert response.json() == [{"id": 1, "title": "пешком"}, {"id": 2, "title": "лыжи"}]
+    assert response.headers["cache-control"] == reference.CACHE_CONTROL
+    etag = response.headers["etag"]
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sync_engine = db.bind.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = await client.get("/reference/activities", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert (await client.get("/reference/areas")).json() == []
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count_statement)
+    assert statements == []
+
+    data = pereval_data.model_dump(mode="json")
+    response = await client.post("/submitData", json=data | {"area_id": 999})
+    assert response.status_code == 400
+    assert response.json()["message"] == "Area with ID 999 not found"
+
+    area = (await client.post("/areas", json={"title": "Кавказ"})).json()
+    response = await client.get("/reference/areas")
+    assert [item["id"] for item in response.json()] == [area["id"]]
+    assert response.headers["etag"] != etag
+
+    response = await client.post("/submitData", json=data | {"area_id": area["id"]})
+    assert response.json()["status"] == 200
+    response = await client.post("/submitData/bulk", json=[data | {"area_id": area["id"]}, data | {"area_id": 999}])
+    assert [result["error"] for result in response.json()["results"]] == [None, "Area with ID 999 not found"]
+
+    # An area created by another worker is not in this worker's snapshot yet
+    db.add(models.PerevalAreas(id=500, title="Памир", path="500"))
+    await db.commit()
+    response = await client.post("/submitData", json=data | {"area_id": 500})
+    assert response.json()["status"] == 200
+    assert [item["id"] for item in (await client.get("/reference/areas")).json()] == [area["id"], 500]
+
+
+@pytest.mark.asyncio
+async def test_submit_data_idempotency_key(client, db, pereval_data):
+    data = pereval_data.model_dump(mode="json")
+    headers = {"Idempotency-Key": "5b0b7a4e-retry"}
+
+    first = await client.post("/submitData", json=data, headers=headers)
+    retry = await client.post("/submitData", json=data, headers=headers)
+    assert first.json()["status"] == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert (await db.execute(select(func.count()).select_from(models.PerevalAdded))).scalar() == 1
+    record = await db.get(models.IdempotencyKey, headers["Idempotency-Key"])
+    assert record.status_code == 200 and json.loads(record.response) == first.json()
+
+    data["title"] = "Другой перевал"
+    response = await client.post("/submitData", json=data, headers=headers)
+    assert response.status_code == 422
+
+    other = await client.post("/submitData", json=data, headers={"Idempotency-Key": "another"})
+    assert other.json()["id"] != first.json()["id"]
+
+    await db.execute(update(models.IdempotencyKey).values(expires_at=datetime(2000, 1, 1)))
+    await db.commit()
+    assert await idempotency.sweep(db) == 2
+    assert (await db.execute(select(func.count()).select_from(models.IdempotencyKey))).scalar() == 0
+
+
+@pytest.mark.asyncio
+async def test_idempotency_key_is_claimed_again_after_abandon(db, monkeypatch):
+    db.add(models.IdempotencyKey(key="abandoned", request_hash="first", expires_at=datetime(2100, 1, 1)))
+    await db.commit()
+    get = db.get
+
+    async def get_after_abandon(model, key, **kwargs):
+        # The request holding the key fails and releases it between our insert and our read
+        monkeypatch.setattr(db, "get", get)
+        await idempotency.abandon(db, key)
+        return await get(model, key, **kwargs)
+
+    monkeypatch.setattr(db, "get", get_after_abandon)
+    assert await idempotency.begin(db, "abandoned", "second") is None
+    record = await db.get(models.IdempotencyKey, "abandoned", populate_existing=True)
+    assert (record.request_hash, record.status_code) == ("second", None)
+
+
+@pytest.mark.asyncio
+async def test_get_pereval_by_email_pagination(client, user_and_coords, pereval_data):
+    user, coords = user_and_coords
+    data = pereval_data.model_dump(mode="json")
+    for day in range(1, 6):
+        data["add_time"] = datetime(2025, 2, day).isoformat()
+        await client.post("/submitData", json=data)
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"user_email": user.email, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get("/submitData/", params=params)
+        seen.extend(pereval["add_time"] for pereval in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert seen == [datetime(2025, 2, day).isoformat() for day in range(1, 6)]
+
+    response = await client.get("/submitData/", params={
+        "user_email": user.email, "date_from": "2025-02-02", "date_to": "2025-02-04", "status": "new",
+    })
+    assert len(response.json()) == 2
+
+    response = await client.get("/submitData/", params={"user_email": user.email, "cursor": "broken"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_perevals_nearby(client, pereval_data):
+    data = pereval_data.model_dump(mode="json")
+    points = {"Эльбрус": (43.3499, 42.4453), "Казбек": (42.6996, 44.5176), "Монблан": (45.8326, 6.8652)}
+    for title, (latitude, longitude) in points.items():
+        data["title"] = title
+        data["coords"] = {"latitude": latitude, "longitude": longitude, "height": 5000}
+        await client.post("/submitData", json=data)
+
+    response = await client.get("/perevals/nearby", params={"latitude": 43.35, "longitude": 42.44, "radius_km": 200})
+    assert [pereval["title"] for pereval in response.json()] == ["Эльбрус", "Казбек"]
+    assert response.json()[0]["distance_km"] < 1
+
+    response = await client.get("/perevals/nearby", params={"latitude": 43.35, "longitude": 42.44, "radius_km": 5})
+    assert [pereval["title"] for pereval in response.json()] == ["Эльбрус"]
+
+    response = await client.get("/perevals/bbox", params={
+        "min_latitude": 40, "min_longitude": 0, "max_latitude": 50, "max_longitude": 43,
+    })
+    assert sorted(pereval["title"] for pereval in response.json()) == ["Монблан", "Эльбрус"]
+
+
+@pytest.mark.asyncio
+async def test_search_perevals(client, pereval_data):
+    data = pereval_data.model_dump(mode="json")
+    for title, other_titles in [("Перевал Дятлова", "Холатчахль"), ("Krestovy Pass", "Джвари"), ("Гумачи", None)]:
+        data["title"] = title
+        data["beauty_title"] = "пер."
+        data["other_titles"] = other_titles
+        await client.post("/submitData", json=data)
+
+    response = await client.get("/search", params={"q": "дятлов"})
+    assert [pereval["title"] for pereval in response.json()] == ["Перевал Дятлова"]
+
+    response = await client.get("/search", params={"q": "krestovyi"})
+    assert response.json()[0]["title"] == "Krestovy Pass"
+    assert 0 < response.json()[0]["score"] < 1
+
+    data["title"] = "Гумачи Южный"
+    data["other_titles"] = "Южный"
+    pereval_id = response.json()[0]["id"]
+    await client.patch(f"/submitData/{pereval_id}", json=data)
+    response = await client.get("/search", params={"q": "джвари"})
+    assert response.json() == []
+
+    response = await client.get("/search", params={"q": "гумачи"})
+    assert sorted(pereval["title"] for pereval in response.json()) == ["Гумачи", "Гумачи Южный"]
+
+
+@pytest.mark.asyncio
+async def test_get_tile(client, pereval_data):
+    data = pereval_data.model_dump(mode="json")
+    for latitude, longitude in [(43.3499, 42.4453), (43.3510, 42.4460), (45.8326, 6.8652)]:
+        data["coords"] = {"latitude": latitude, "longitude": longitude, "height": 5000}
+        response = await client.post("/submitData", json=data)
+    mont_blanc_id = response.json()["id"]
+
+    response = await client.get("/tiles/3/4/2")
+    clusters = sorted(response.json()["clusters"], key=lambda cluster: cluster["count"])
+    assert [cluster["count"] for cluster in clusters] == [1, 2]
+    assert clusters[1]["latitude"] == pytest.approx(43.35045)
+
+    data["coords"] = {"latitude": 43.3505, "longitude": 42.4455, "height": 5000}
+    await client.patch(f"/submitData/{mont_blanc_id}", json=data)
+
+    response = await client.get("/tiles/3/4/2")
+    assert [cluster["count"] for cluster in response.json()["clusters"]] == [3]
+
+    response = await client.get("/tiles/16/40494/23993")
+    assert sorted(cluster["latitude"] for cluster in response.json()["clusters"]) == [43.3499, 43.3505]
+    assert all(cluster["pereval_id"] for cluster in response.json()["clusters"])
+
+
+@pytest.mark.asyncio
+async def test_tile_deltas_are_folded(client, db, pereval_data):
+    data = pereval_data.model_dump(mode="json")
+    for latitude, longitude in [(43.3499, 42.4453), (43.3510, 42.4460)]:
+        data["coords"] = {"latitude": latitude, "longitude": longitude, "height": 5000}
+        response = await client.post("/submitData", json=data)
+    data["coords"] = {"latitude": 45.8326, "longitude": 6.8652, "height": 5000}
+    await client.patch(f"/submitData/{response.json()['id']}", json=data)
+
+    before = (await client.get("/tiles/3/4/2")).json()
+    assert await db.scalar(select(func.count()).select_from(models.TileCluster)) == 0
+
+    assert await tiles.fold_deltas(db) > 0
+    assert await db.scalar(select(func.count()).select_from(models.TileClusterDelta)) == 0
+    assert await tiles.fold_deltas(db) == 0
+    assert (await client.get("/tiles/3/4/2")).json() == before
+    assert [cluster["count"] for cluster in before["clusters"]] == [1, 1]
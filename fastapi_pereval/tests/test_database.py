@@ -1,31 +1,33 @@
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from fastapi_pereval import models, schemas, services
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+from fastapi_pereval import geo, models, schemas, services
 from faker import Faker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"  
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+@pytest_asyncio.fixture(scope="function")
+async def db():
+    engine = create_async_engine(SQLALCHEMY_DATABASE_URL, poolclass=StaticPool)
+    SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
 
-models.Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
 
-@pytest.fixture(scope="function")
-def db():
-    db = SessionLocal()
+    async with SessionLocal() as db:
+        yield db
 
-    models.Base.metadata.drop_all(bind=engine)
-    models.Base.metadata.create_all(bind=engine)
-    yield db
-    db.close()
+    await engine.dispose()
 
 @pytest.fixture
 def db_service(db):
     return services.DatabaseService(db)
 
-@pytest.fixture
-def user_and_coords(db_service):
+@pytest_asyncio.fixture
+async def user_and_coords(db_service):
     fake = Faker()
     user_data = schemas.UserCreate(
         email=fake.email(),
@@ -35,8 +37,9 @@ def user_and_coords(db_service):
     )
     coords_data = schemas.CoordsCreate(latitude=40.7128, longitude=74.0060, height=5000)
 
-    user = db_service.create_user(user_data)
-    coords = db_service.create_coords(coords_data)
+    user = await db_service.create_user(user_data)
+    coords = await db_service.create_coords(coords_data)
+    await db_service.db.commit()
     return user, coords
 
 @pytest.fixture
@@ -56,7 +59,8 @@ def pereval_data(user_and_coords):
         spring_level="4",
     )
 
-def test_create_user(user_and_coords):
+@pytest.mark.asyncio
+async def test_create_user(user_and_coords):
     user, coords = user_and_coords
 
     assert user.email == user.email
@@ -65,7 +69,8 @@ def test_create_user(user_and_coords):
     assert user.name == user.name
 
 
-def test_create_coords(user_and_coords):
+@pytest.mark.asyncio
+async def test_create_coords(user_and_coords):
     user, coords = user_and_coords
 
     assert coords.latitude == 40.7128
@@ -73,10 +78,11 @@ def test_create_coords(user_and_coords):
     assert coords.height == 5000
 
 
-def test_create_pereval(db_service, user_and_coords, pereval_data):
+@pytest.mark.asyncio
+async def test_create_pereval(db_service, user_and_coords, pereval_data):
     user, coords = user_and_coords
     
-    pereval = db_service.create_pereval(pereval_data, user.id, coords.id)
+    pereval = await db_service.create_pereval(pereval_data, user.id, coords.id)
 
     assert pereval.title == "Пик Эверест"
     assert pereval.beauty_title == "Величественный Эверест"
@@ -85,42 +91,87 @@ def test_create_pereval(db_service, user_and_coords, pereval_data):
     assert pereval.coord_id == coords.id
 
 
-def test_create_pereval_images(db_service, user_and_coords, pereval_data):
+@pytest.mark.asyncio
+async def test_create_pereval_images(db_service, user_and_coords, pereval_data):
     user, coords = user_and_coords
     
-    pereval = db_service.create_pereval(pereval_data, user.id, coords.id)
+    pereval = await db_service.create_pereval(pereval_data, user.id, coords.id)
 
     image_data = schemas.PerevalImagesCreate(pereval_id=pereval.id, img_title="Эверест изображение", img="image_data")
-    image = db_service.create_pereval_images(image_data)
+    image = await db_service.create_pereval_images(image_data)
 
     assert image.pereval_id == pereval.id
     assert image.img_title == "Эверест изображение"
     assert image.img == "image_data"
 
 
-def test_get_user_by_email(db_service, user_and_coords):
+@pytest.mark.asyncio
+async def test_get_user_by_email(db_service, user_and_coords):
     user, coords = user_and_coords
     
-    found_user = db_service.get_user_by_email(user.email)
+    found_user = await db_service.get_user_by_email(user.email)
     
     assert found_user.email == user.email
 
 
-def test_get_pereval_by_id(db_service, user_and_coords, pereval_data):
+@pytest.mark.asyncio
+async def test_get_pereval_by_id(db_service, user_and_coords, pereval_data):
     user, coords = user_and_coords
     
-    pereval = db_service.create_pereval(pereval_data, user.id, coords.id)
-    found_pereval = db_service.get_pereval_by_id(pereval.id)
+    pereval = await db_service.create_pereval(pereval_data, user.id, coords.id)
+    found_pereval = await db_service.get_pereval_by_id(pereval.id)
     
     assert found_pereval.id == pereval.id
 
 
-def test_get_pereval_by_email(db_service, user_and_coords, pereval_data):
+@pytest.mark.asyncio
+async def test_get_pereval_by_email(db_service, user_and_coords, pereval_data):
     user, coords = user_and_coords
     
-    db_service.create_pereval(pereval_data, user.id, coords.id)
+    await db_service.create_pereval(pereval_data, user.id, coords.id)
     
-    perevals = db_service.get_pereval_by_email(user.email)
+    perevals = await db_service.get_pereval_by_email(user.email)
     
     assert len(perevals) > 0
-    assert perevals[0].title == "Пик Эверест"
\ No newline at end of file
+    assert perevals[0].title == "Пик Эверест"
+
+@pytest.mark.asyncio
+async def test_submit_pereval(db, db_service, pereval_data):
+    pereval_data.images = [
+        schemas.PerevalImagesCreate(img_title="Седловина", img="image_1"),
+        schemas.PerevalImagesCreate(img_title="Подъём", img="image_2"),
+    ]
+
+    pereval_id = await db_service.submit_pereval(pereval_data)
+    pereval = await db_service.get_pereval_by_id(pereval_id)
+
+    assert pereval.title == "Пик Эверест"
+    assert pereval.status == "new"
+    assert pereval.user.email == pereval_data.user.email
+    assert [image.img for image in pereval.images] == ["image_1", "image_2"]
+
+
+@pytest.mark.asyncio
+async def test_submit_pereval_rolls_back_on_error(db, db_service, pereval_data):
+    async def count(model):
+        return await db.scalar(select(func.count()).select_from(model))
+
+    counts_before = {model: await count(model) for model in (models.User, models.Coords, models.PerevalImages)}
+    pereval_data.user = schemas.UserCreate(email="new@example.com", phone="+7 000", fam="fam", name="name")
+    pereval_data.images = [schemas.PerevalImagesCreate(img_title="Седловина", img="image_1")]
+    pereval_data.images[0].img = None
+
+    with pytest.raises(IntegrityError):
+        await db_service.submit_pereval(pereval_data)
+
+    for model, before in counts_before.items():
+        assert await count(model) == before
+    assert await count(models.PerevalAdded) == 0
+
+
+@pytest.mark.asyncio
+async def test_coords_geohash(db, user_and_coords):
+    user, coords = user_and_coords
+
+    assert coords.geohash == geo.encode(40.7128, 74.0060)
+    assert geo.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
@@ -0,0 +1,36 @@
+import base64
+import pytest
+from fastapi_pereval import imaging, storage
+
+
+@pytest.fixture
+def blob_storage(tmp_path):
+    return storage.LocalBlobStorage(str(tmp_path))
+
+
+def test_put_is_content_addressed(blob_storage):
+    key = blob_storage.put(b"image bytes")
+
+    assert storage.is_reference(key)
+    assert blob_storage.put(b"image bytes") == key
+    assert b"".join(blob_storage.iter_chunks(key, chunk_size=4)) == b"image bytes"
+
+
+def test_iter_chunks_missing_blob(blob_storage):
+    with pytest.raises(storage.BlobNotFound):
+        list(blob_storage.iter_chunks("0" * 64))
+
+
+def test_store_inline_image(blob_storage):
+    key = storage.store_inline_image(blob_storage, "data:image/png;base64," + base64.b64encode(b"png").decode())
+
+    assert b"".join(blob_storage.iter_chunks(key)) == b"png"
+    assert storage.store_inline_image(blob_storage, key) == key
+    assert b"".join(blob_storage.iter_chunks(storage.store_inline_image(blob_storage, "<image1>"))) == b"<image1>"
+
+
+def test_generate_variants_skips_non_images(blob_storage):
+    key = blob_storage.put(b"not an image")
+
+    assert imaging.generate_variants(blob_storage, key) == []
+    assert not blob_storage.exists(storage.variant_key(key, "thumb"))
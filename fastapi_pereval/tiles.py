@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import math
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import models
+
+MAX_CLUSTER_ZOOM = 14
+CELL_BITS = 3
+CELLS_PER_TILE = 2 ** CELL_BITS
+MAX_LATITUDE = 85.05112878
+UPSERT_BATCH_SIZE = 1000
+FOLD_BATCH_SIZE = 5000
+FOLD_INTERVAL = float(os.getenv("FSTR_TILE_FOLD_INTERVAL", "2"))
+
+Delta = Tuple[int, float, float]
+
+logger = logging.getLogger(__name__)
+
+
+def _world_position(latitude: float, longitude: float) -> Tuple[float, float]:
+    """Web Mercator position of a point scaled to [0, 1)"""
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    x = (longitude + 180.0) / 360.0
+    y = (1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0
+    return min(x, math.nextafter(1.0, 0)), min(y, math.nextafter(1.0, 0))
+
+
+def cell_for(latitude: float, longitude: float, zoom: int) -> Tuple[int, int]:
+    """Get the cluster cell of a point, each tile is split into CELLS_PER_TILE x CELLS_PER_TILE cells"""
+    cells = 2 ** (zoom + CELL_BITS)
+    x, y = _world_position(latitude, longitude)
+    return int(x * cells), int(y * cells)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Get (min_latitude, min_longitude, max_latitude, max_longitude) of a tile"""
+    tiles = 2 ** zoom
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles))))
+
+    return latitude(y + 1), x / tiles * 360.0 - 180.0, latitude(y), (x + 1) / tiles * 360.0 - 180.0
+
+
+def cluster_deltas(points: Iterable[Tuple[float, float]], sign: int = 1) -> Dict[Tuple[int, int, int], Delta]:
+    """Aggregate per-zoom (count, sum_latitude, sum_longitude) changes for added (sign=1) or removed points"""
+    deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    for latitude, longitude in points:
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            delta = deltas[(zoom, *cell_for(latitude, longitude, zoom))]
+            delta[0] += sign
+            delta[1] += sign * latitude
+            delta[2] += sign * longitude
+    return {key: tuple(delta) for key, delta in deltas.items()}
+
+
+def merge_deltas(*deltas: Dict[Tuple[int, int, int], Delta]) -> Dict[Tuple[int, int, int], Delta]:
+    """Combine several deltas, dropping cells whose changes cancel out"""
+    merged = defaultdict(lambda: (0, 0.0, 0.0))
+    for delta in deltas:
+        for key, (count, sum_latitude, sum_longitude) in delta.items():
+            old = merged[key]
+            merged[key] = (old[0] + count, old[1] + sum_latitude, old[2] + sum_longitude)
+    return {key: delta for key, delta in merged.items() if delta != (0, 0.0, 0.0)}
+
+
+def upsert_statement(dialect_name: str, deltas: Dict[Tuple[int, int, int], Delta]):
+    """Build an INSERT ... ON CONFLICT statement that adds the deltas to the stored aggregates"""
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    table = models.TileCluster.__table__
+    # Sorted keys keep the row lock order stable between concurrent writers
+    statement = insert(table).values([
+        {"zoom": zoom, "cell_x": cell_x, "cell_y": cell_y,
+         "count": count, "sum_latitude": sum_latitude, "sum_longitude": sum_longitude}
+        for (zoom, cell_x, cell_y), (count, sum_latitude, sum_longitude) in sorted(deltas.items())
+    ])
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.zoom, table.c.cell_x, table.c.cell_y],
+        set_={
+            "count": table.c.count + statement.excluded.count,
+            "sum_latitude": table.c.sum_latitude + statement.excluded.sum_latitude,
+            "sum_longitude": table.c.sum_longitude + statement.excluded.sum_longitude,
+        },
+    )
+
+
+async def apply_deltas(db, deltas: Dict[Tuple[int, int, int], Delta]):
+    """Add cluster deltas to the stored aggregates in the current transaction"""
+    items = sorted(deltas.items())
+    for start in range(0, len(items), UPSERT_BATCH_SIZE):
+        await db.execute(upsert_statement(db.bind.dialect.name, dict(items[start:start + UPSERT_BATCH_SIZE])))
+
+
+async def queue_deltas(db, deltas: Dict[Tuple[int, int, int], Delta]):
+    """Append cluster deltas to the queue in the current transaction.
+
+    Every point shares the low zoom cells, so writers only insert queue rows and leave the
+    shared aggregate rows to fold_deltas instead of locking them until they commit.
+    """
+    if deltas:
+        await db.execute(insert(models.TileClusterDelta), [
+            {"zoom": zoom, "cell_x": cell_x, "cell_y": cell_y,
+             "count": count, "sum_latitude": sum_latitude, "sum_longitude": sum_longitude}
+            for (zoom, cell_x, cell_y), (count, sum_latitude, sum_longitude) in sorted(deltas.items())
+        ])
+
+
+async def fold_deltas(db, limit: int = FOLD_BATCH_SIZE) -> int:
+    """Move a batch of queued deltas into the aggregates, return how many queue rows were folded"""
+    table = models.TileClusterDelta.__table__
+    try:
+        rows = (await db.execute(
+            select(table).order_by(table.c.id).limit(limit).with_for_update(skip_locked=True)
+        )).all()
+        if not rows:
+            return 0
+        await db.execute(delete(table).where(table.c.id.in_([row.id for row in rows])))
+        await apply_deltas(db, merge_deltas(*(
+            {(row.zoom, row.cell_x, row.cell_y): (row.count, row.sum_latitude, row.sum_longitude)} for row in rows
+        )))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return len(rows)
+
+
+async def fold_periodically(session_factory, interval: float = FOLD_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as db:
+                while await fold_deltas(db) == FOLD_BATCH_SIZE:
+                    pass
+        except Exception:
+            logger.exception("Tile cluster fold failed")
+
+
+def tile_cell_range(zoom: int, x: int, y: int) -> Tuple[int, int, int, int]:
+    return x * CELLS_PER_TILE, (x + 1) * CELLS_PER_TILE - 1, y * CELLS_PER_TILE, (y + 1) * CELLS_PER_TILE - 1
+
+
+def cluster_markers(rows) -> List[dict]:
+    """Convert stored aggregates into cluster markers with centroids"""
+    return [
+        {"count": row.count, "latitude": row.sum_latitude / row.count, "longitude": row.sum_longitude / row.count}
+        for row in rows
+    ]